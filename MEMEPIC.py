@@ -1,16 +1,29 @@
+import time
+STARTED = time.perf_counter()  # for the time-to-first-frame report
 import os
-import io
-import cv2
 import json
-import numpy as np
 import tkinter as tk
-from tkinter import filedialog, colorchooser, IntVar, StringVar, Checkbutton, Entry, Label, Button, Scale, Toplevel, Canvas, Menu, messagebox
-from PIL import Image, ImageTk, ImageGrab
-import win32clipboard as clp
-from datetime import datetime
+from tkinter import filedialog, colorchooser, simpledialog, IntVar, StringVar, Checkbutton, Entry, Label, Button, Scale, Toplevel, Canvas, Menu, messagebox
+from PIL import Image, ImageTk
+from memepic_clipboard import ClipboardPipeline
+from memepic_export import ExportOptions, ExportQueue
+from memepic_scheduler import RenderScheduler
+from memepic_startup import lazy_import
+from memepic_trace import TRACER, span
+
+# cv2 and numpy load with these on first use, after the window is up
+memepic_render = lazy_import('memepic_render')
+memepic_transparency = lazy_import('memepic_transparency')
+memepic_layers = lazy_import('memepic_layers')
+memepic_animation = lazy_import('memepic_animation')
+memepic_source = lazy_import('memepic_source')
+memepic_truetype = lazy_import('memepic_truetype')
+memepic_history = lazy_import('memepic_history')
 
 CONFIG_FILE = "config.json"
 EXAMPLE_IMAGE = '.\\IMAGES\\EXAMPLE.png'
+RENDER_POLL_MS = 15
+SAVE_SIZES = ('full', 1080, 512, 300)  # Options > Save Sizes
 
 def mask_path(path):
     user_home = os.path.expanduser("~")
@@ -29,17 +42,16 @@ def unmask_path(path):
     else:
         return path
 
-def create_polaroid(image, border_size=50):
-    width, height = image.size
-    new_width = width + 2 * border_size
-    new_height = height + 4 * border_size  # Increased bottom border
-    polaroid = Image.new('RGBA', (new_width, new_height), (255, 255, 255, 255))
-    polaroid.paste(image, (border_size, border_size))
-    return polaroid
-
 def normalize_path(path):
     return os.path.normpath(path).replace('\\', '/')
 
+def config_image_path(config):
+    # Relative paths in config.json are relative to this script
+    image_path = config.get('image_path', EXAMPLE_IMAGE)
+    if not os.path.isabs(image_path):
+        image_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), image_path)
+    return normalize_path(os.path.abspath(image_path))
+
 class MEMEPICApp:
     def __init__(self, root):
         self.root = root
@@ -51,6 +63,19 @@ class MEMEPICApp:
         if not os.path.exists(default_output_folder):
             os.makedirs(default_output_folder)
 
+        self.source = None
+        self.history = None  # edits (Polaroid, ...) over the loaded image, for undo/redo
+        self.history_mb = 256  # memory for the history's checkpoints
+        self.layer_renderer = None  # created with the render stack in start_rendering
+        self.render_scheduler = RenderScheduler(self.render_preview)
+        self.key_cache = None
+        self.export_queue = ExportQueue()
+        self.clipboard = ClipboardPipeline()
+        self.processed_image = None
+        self.processed_key = None
+        self.preview_key = None
+        self.first_frame_ms = None
+
         self.create_widgets()
 
         # Set a fixed size for the image label
@@ -59,209 +84,126 @@ class MEMEPICApp:
 
         self.set_image_window_size()
 
-        self.load_sample_image()
-
-        self.root.protocol("WM_DELETE_WINDOW", lambda: (self.save_settings(), self.root.destroy()))
+        self.root.protocol("WM_DELETE_WINDOW", lambda: (self.save_settings(), self.render_scheduler.close(), self.export_queue.shutdown(), self.root.destroy()))
         self.load_settings()
 
         # Set default output folder if not set in settings
         if not self.entry_output_folder.get():
             self.entry_output_folder.insert(0, default_output_folder)
 
+        # Show the window first; the render stack and the restored image load once it is up
+        self.root.after_idle(lambda: self.root.after(0, self.start_rendering))
+
+    def start_rendering(self):
+        self.layer_renderer = memepic_layers.LayeredRenderer()
+        self.key_cache = memepic_transparency.KeyMaskCache()
+        self.load_image(self.entry_image_path.get())
+        self.poll_renders()
+
+    def render_preview(self, proxy, spec, full_size):
+        return self.layer_renderer.render_preview(proxy, spec, full_size)
+
     def set_image_window_size(self):
         # Limit the window size when no image is loaded
         self.root.update_idletasks()  # Update the window size based on widgets
         self.root.geometry(f"{self.root.winfo_width()}x{self.root.winfo_height()}")  # Set the window size
 
-    def load_sample_image(self):
-        sample_image_path = EXAMPLE_IMAGE
-        if os.path.exists(sample_image_path):
-            self.image = Image.open(sample_image_path).convert("RGBA")
-            self.update_image_label()
-        else:
-            self.img_label.config(text="Sample Image Not Found")
+    @property
+    def image(self):
+        # Full-resolution RGBA; decoded lazily for a file source, so only touch it for exports
+        source = getattr(self, 'source', None)
+        return source.full() if source is not None else None
+
+    @image.setter
+    def image(self, image):
+        self.set_source(memepic_source.ImageSource(image) if image is not None else None)
+
+    def set_source(self, source):
+        # A newly loaded image starts a new edit history
+        self.source = source
+        self.history = memepic_history.EditHistory(source, budget_bytes=self.history_mb * 1024 * 1024) if source is not None else None
 
     def update_image_label(self):
-        if self.image:
+        if self.source:
             # Resize the image to fit within the label while maintaining aspect ratio
-            img_resized = self.resize_image(self.image, 300, 300)
-            img_display = ImageTk.PhotoImage(img_resized)
+            img_resized = self.resize_image(self.source.preview(), 300, 300)
+            with span('photoimage'):
+                img_display = ImageTk.PhotoImage(img_resized)
             self.img_label.config(image=img_display, text="")
             self.img_label.image = img_display
         else:
             self.img_label.config(text="No Image Loaded")
 
     def resize_image(self, image, max_width, max_height):
-        width_ratio = max_width / image.width
-        height_ratio = max_height / image.height
-        new_ratio = min(width_ratio, height_ratio)
-        new_width = int(image.width * new_ratio)
-        new_height = int(image.height * new_ratio)
-        return image.resize((new_width, new_height), Image.LANCZOS)
-
-    def make_transparent(self, image):
-        if self.var_transparency.get() != 1:
-            return image  # Return the original image if transparency is not set
-        
-        data = np.array(image)
-        if data.shape[2] == 3:  # RGB image
-            rgb = data
-            alpha = np.full((data.shape[0], data.shape[1]), 255, dtype=np.uint8)
-        else:  # RGBA image
-            rgb = data[:,:,:3]
-            alpha = data[:,:,3]
-
-        # Make only pure white (255, 255, 255) transparent
-        mask = (rgb == [255, 255, 255]).all(axis=2)
-        alpha[mask] = 0
-
-        return Image.fromarray(np.dstack((rgb, alpha)))
+        return memepic_render.resize_image(image, max_width, max_height)
 
     def copy_to_clipboard_method(self):
-        self.update_image_with_settings()
-        if hasattr(self, 'processed_image') and self.processed_image is not None:
-            try:
-                temp_file = './temp_image.png'
-                image_to_copy = self.processed_image.copy()
-                
-                if self.var_transparency.get() == 1:
-                    # If transparency is selected, keep the image as is (with transparency)
-                    if image_to_copy.mode != 'RGBA':
-                        image_to_copy = image_to_copy.convert('RGBA')
-                else:
-                    # If transparency is not selected, ensure opaque background
-                    if image_to_copy.mode in ('RGBA', 'LA'):
-                        background = Image.new(image_to_copy.mode[:-1], image_to_copy.size, (255, 255, 255))
-                        background.paste(image_to_copy, mask=image_to_copy.split()[-1])
-                        image_to_copy = background.convert('RGB')
-                
-                image_to_copy.save(temp_file, format="PNG")
-
-                clp.OpenClipboard()
-                clp.EmptyClipboard()
-
-                wide_path = os.path.abspath(temp_file).encode('utf-16-le') + b'\0'
-                clp.SetClipboardData(clp.RegisterClipboardFormat('FileNameW'), wide_path)
-
-                with open(temp_file, 'rb') as f:
-                    clp.SetClipboardData(clp.RegisterClipboardFormat('PNG'), f.read())
-
-                clp.CloseClipboard()
-
-                print(f"Image copied to clipboard and saved as {temp_file}")
-            except Exception as e:
-                print(f"Error copying image to clipboard: {e}")
-        else:
+        if self.source is None:
             print("No processed image available to copy")
-        
+            return
+        key = self.render_key()
+        try:
+            with span('copy'):
+                nbytes = self.clipboard.copy(key, lambda: self.processed_render(key), self.var_transparency.get() == 1)
+            print(f"Image copied to clipboard ({self.clipboard.backend.name}, {nbytes} bytes)")
+        except Exception as e:
+            print(f"Error copying image to clipboard: {e}")
+
+    def render_key(self):
+        # Identifies a full-resolution render: the source object plus every caption setting
+        return (self.source, tuple(sorted(self.current_spec().to_dict().items())))
+
+    def processed_render(self, key):
+        # Reuse the last full render when nothing has changed since
+        if self.processed_image is None or key != self.processed_key:
+            self.update_image_with_settings()
+            if key != self.processed_key:
+                raise RuntimeError("Failed to update image with settings")
+        return self.processed_image
+
     def update_image_with_settings(self):
         if self.image is None:
             print("No image loaded.")
             return
 
-        working_image = self.image.copy()
+        # A full render supersedes any preview still in flight
+        self.render_scheduler.cancel()
 
-        slogan = self.entry_slogan.get("1.0", "end-1c")
-        font_size = self.scale_font_size.get()
-        font_thickness = self.scale_font_thickness.get()
-        font_color = self.color_var.get() or '255,255,255'
-        outline_color = self.outline_color_var.get() or '0,0,0'
-        outline_thickness = self.scale_outline_thickness.get() + 2 if self.scale_outline_thickness.get() > 0 else 0
-        box_color = self.box_color_var.get() or '0,0,0'
-        box_opacity = self.scale_box_opacity.get() / 100.0
-        use_box = box_opacity > 0
-        text_position = self.scale_text_position.get()
-        box_width = self.scale_box_width.get()
-
-        working_image = self.add_slogan_to_image(working_image, slogan, font_color, font_thickness, font_size, outline_color, outline_thickness, box_color, box_opacity, use_box, text_position, box_width)
-
-        if working_image:
-            self.processed_image = working_image
-            display_image = working_image.copy()
-            
-            if self.var_transparency.get() == 1:
-                display_image = self.make_transparent(display_image)
-            
-            display_image = self.resize_image(display_image, 300, 300)
-            self.updated_image = ImageTk.PhotoImage(display_image)
+        # One copy of the source frame; caption and transparency are applied to it in place
+        with span('full_render'):
+            frame = memepic_render.render_frame(self.get_source_array(), self.current_spec(), key_cache=self.key_cache)
+
+        if frame is not None:
+            self.processed_image = memepic_render.frame_to_image(frame)
+            self.processed_key = self.render_key()
+            display_image = self.resize_image(self.processed_image, 300, 300)
+            with span('photoimage'):
+                self.updated_image = ImageTk.PhotoImage(display_image)
             self.img_label.config(image=self.updated_image)
             self.img_label.image = self.updated_image
         else:
             print("Failed to update image with settings")
 
-    def add_slogan_to_image(self, image, slogan_text, font_color_str, font_thickness, font_scale, outline_color_str, outline_thickness, box_color_str, box_opacity, use_box, text_position, box_width):
-        if image is None:
-            print("No image loaded.")
-            return None
-
-        image_np = np.array(image)
-        if image_np.shape[2] == 3:
-            image_np = cv2.cvtColor(image_np, cv2.COLOR_RGB2RGBA)
-        elif image_np.shape[2] == 4:
-            pass
-        else:
-            print("Unsupported image format")
-            return None
-
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        image_height, image_width = image_np.shape[:2]
-
-        lines = slogan_text.split('\n')
-        if all(line == '' for line in lines):
-            return Image.fromarray(image_np)
-
-        max_line_height = cv2.getTextSize('Tg', font, font_scale, int(font_thickness))[0][1]
-        
-        text_sizes = [cv2.getTextSize(line, font, font_scale, int(font_thickness))[0] for line in lines]
-        text_width = max(size[0] for size in text_sizes)
-        text_height = max_line_height * len(lines)
-        line_spacing = int(max_line_height * 0.3)
-        line_padding = 9  # Add padding between lines
-        total_height = text_height + (len(lines) - 1) * (line_spacing + line_padding)
-        
-        while text_width > image_width and font_scale > 0.5:
-            font_scale -= 0.1
-            max_line_height = cv2.getTextSize('Tg', font, font_scale, int(font_thickness))[0][1]
-            text_sizes = [cv2.getTextSize(line, font, font_scale, int(font_thickness))[0] for line in lines]
-            text_width = max(size[0] for size in text_sizes)
-            text_height = max_line_height * len(lines)
-            line_spacing = int(max_line_height * 0.3)
-            total_height = text_height + (len(lines) - 1) * (line_spacing + line_padding)
-
-        text_position = text_position / 100.0
-        text_y = int(text_position * (image_height - total_height)) + max_line_height
-
-        text_x = (image_width - text_width) // 2
-
-        padding = int(max_line_height * 0.2)
-
-        font_color = tuple(int(c) for c in font_color_str.split(',')[:3])
-        box_color = tuple(int(c) for c in box_color_str.split(',')[:3])
-        outline_color = tuple(int(c) for c in outline_color_str.split(',')[:3]) if outline_color_str and outline_thickness > 0 else None
-
-        if use_box:
-            box_width_pixels = int(image_width * (box_width / 100))
-            rect_left = max(0, (image_width - box_width_pixels) // 2)
-            rect_right = min(image_width, rect_left + box_width_pixels)
-            rect_top = max(0, text_y - max_line_height - padding - line_padding)
-            rect_bottom = min(image_height, text_y + total_height - max_line_height + padding + line_padding)
-            overlay = image_np.copy()
-            cv2.rectangle(overlay, (rect_left, rect_top), (rect_right, rect_bottom), box_color + (255,), -1)
-            cv2.addWeighted(overlay, box_opacity, image_np, 1 - box_opacity, 0, image_np)
-
-        for i, line in enumerate(lines):
-            line_y = text_y + i * (max_line_height + line_spacing + line_padding)
-            if 0 <= line_y <= image_height:
-                line_x = text_x  # Left-align the text within the box
-                
-                if outline_thickness > 0 and outline_color is not None:
-                    for dx in range(-outline_thickness, outline_thickness + 1):
-                        for dy in range(-outline_thickness, outline_thickness + 1):
-                            if dx != 0 or dy != 0:
-                                cv2.putText(image_np, line, (line_x + dx, line_y + dy), font, font_scale, outline_color + (255,), outline_thickness)
-                cv2.putText(image_np, line, (line_x, line_y), font, font_scale, font_color + (255,), font_thickness)
-
-        return Image.fromarray(image_np)
+    def get_source_array(self):
+        return self.source.array()
+
+    def current_spec(self):
+        return memepic_render.CaptionSpec(
+            slogan=self.entry_slogan.get("1.0", "end-1c"),
+            font_color=self.color_var.get() or '255,255,255',
+            font_thickness=self.scale_font_thickness.get(),
+            font_scale=self.scale_font_size.get(),
+            outline_color=self.outline_color_var.get() or '0,0,0',
+            outline_thickness=self.scale_outline_thickness.get() + 2 if self.scale_outline_thickness.get() > 0 else 0,
+            box_color=self.box_color_var.get() or '0,0,0',
+            box_opacity=self.scale_box_opacity.get() / 100.0,
+            text_position=self.scale_text_position.get(),
+            box_width=self.scale_box_width.get(),
+            transparency=self.var_transparency.get() == 1,
+            transparency_tolerance=self.transparency_tolerance,
+            transparency_mode=self.transparency_mode.get(),
+            font=self.font,
+        )
     
     def reload_image(self):
         self.load_image(self.entry_image_path.get())
@@ -288,33 +230,86 @@ class MEMEPICApp:
             json.dump(config, file)
 
     def on_save(self):
-        if hasattr(self, 'processed_image') and self.processed_image is not None:
-            output_folder = self.entry_output_folder.get()
-            if not os.path.exists(output_folder):
-                os.makedirs(output_folder)
-            
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            file_name = f"meme_{timestamp}.png"
-            file_path = os.path.normpath(os.path.join(output_folder, file_name))
-            
-            saved_image = self.processed_image.copy()
-            # Only apply transparency if it's explicitly set
-            if self.var_transparency.get() == 1:
-                saved_image = self.make_transparent(saved_image)
-            
-            saved_image.save(file_path, "PNG")
-            print(f"Image saved to {file_path}")
-        else:
+        if self.source is None:
             print("No processed image available to save")
+            return
+        output_folder = self.entry_output_folder.get()
+        source = self.source
+        spec = self.current_spec()
+        if source.animated:
+            # Every frame gets the caption; written back in the source's animated format
+            writer = lambda path, folder, options, prefix: memepic_animation.export_animation(path, folder, spec, options, prefix, os.cpu_count() or 1)
+            self.export_queue.submit(source.path, output_folder, self.export_options(), writer=writer)
+            self.label_status.config(text=self.export_queue.status_line())
+            return
+        # Render and encode on the export workers; the UI thread only queues the job
+        self.export_queue.submit(lambda: memepic_render.frame_to_image(memepic_render.render_frame(source.array(), spec, key_cache=self.key_cache)), output_folder, self.export_options())
+        self.label_status.config(text=self.export_queue.status_line())
+
+    def export_options(self):
+        sizes = [size for size, variable in self.save_sizes.items() if variable.get()]
+        return ExportOptions(self.export_format.get(), self.png_compress_level.get(), self.export_quality, sizes or None)
+
+    def report_exports(self):
+        for result in self.export_queue.poll():
+            if result.error is None:
+                print(f"Image saved to {result.file_path}")
+            else:
+                print(f"Error saving image: {result.error}")
+            self.label_status.config(text=self.export_queue.status_line())
 
     def create_widgets(self):
         toolbar = tk.Menu(self.root)
         self.root.config(menu=toolbar)
 
+        edit_menu = tk.Menu(toolbar, tearoff=0)
+        toolbar.add_cascade(label="Edit", menu=edit_menu)
+        edit_menu.add_command(label="Undo", accelerator="Ctrl+Z", command=self.undo_edit)
+        edit_menu.add_command(label="Redo", accelerator="Ctrl+Y", command=self.redo_edit)
+        self.root.bind("<Control-z>", lambda event: self.edit_shortcut(self.undo_edit))
+        self.root.bind("<Control-y>", lambda event: self.edit_shortcut(self.redo_edit))
+
         view_menu = tk.Menu(toolbar, tearoff=0)
         toolbar.add_cascade(label="Options", menu=view_menu)
         self.on_top = IntVar()
         view_menu.add_checkbutton(label="On Top", variable=self.on_top, command=lambda: self.root.attributes('-topmost', self.on_top.get()))
+        view_menu.add_command(label="Render Stats", command=self.show_render_stats)
+        self.trace_timings = IntVar()
+        view_menu.add_checkbutton(label="Trace Timings", variable=self.trace_timings, command=lambda: TRACER.enable() if self.trace_timings.get() else TRACER.disable())
+        view_menu.add_command(label="Timing Percentiles", command=self.show_timing_percentiles)
+        view_menu.add_command(label="Save Trace...", command=self.save_trace)
+        transparency_menu = tk.Menu(view_menu, tearoff=0)
+        view_menu.add_cascade(label="Transparency", menu=transparency_menu)
+        self.transparency_mode = StringVar(value='all')
+        self.transparency_tolerance = 0
+        transparency_menu.add_radiobutton(label="All White", value='all', variable=self.transparency_mode, command=self.update_sample_text)
+        transparency_menu.add_radiobutton(label="White Touching Border", value='border', variable=self.transparency_mode, command=self.update_sample_text)
+        font_menu = tk.Menu(view_menu, tearoff=0)
+        view_menu.add_cascade(label="Font", menu=font_menu)
+        self.font = ''
+        font_menu.add_command(label="TrueType Font...", command=self.select_font)
+        font_menu.add_command(label="Built-in Font", command=lambda: self.set_font(''))
+        export_menu = tk.Menu(view_menu, tearoff=0)
+        view_menu.add_cascade(label="Save Format", menu=export_menu)
+        self.export_format = StringVar(value='png')
+        self.png_compress_level = IntVar(value=6)
+        self.export_quality = 90
+        export_menu.add_radiobutton(label="PNG", value='png', variable=self.export_format)
+        export_menu.add_radiobutton(label="JPEG", value='jpeg', variable=self.export_format)
+        export_menu.add_radiobutton(label="WebP", value='webp', variable=self.export_format)
+        export_menu.add_separator()
+        compress_menu = tk.Menu(export_menu, tearoff=0)
+        export_menu.add_cascade(label="PNG Compression", menu=compress_menu)
+        for level in range(10):
+            label = f"{level} (fastest)" if level == 0 else f"{level} (smallest)" if level == 9 else str(level)
+            compress_menu.add_radiobutton(label=label, value=level, variable=self.png_compress_level)
+        export_menu.add_command(label="JPEG/WebP Quality...", command=self.select_export_quality)
+        sizes_menu = tk.Menu(view_menu, tearoff=0)
+        view_menu.add_cascade(label="Save Sizes", menu=sizes_menu)
+        # One render per SAVE; each ticked size is resized from the next larger one
+        self.save_sizes = {size: IntVar(value=size == 'full') for size in SAVE_SIZES}
+        for size, variable in self.save_sizes.items():
+            sizes_menu.add_checkbutton(label="Full" if size == 'full' else f"{size} px", variable=variable)
 
         help_menu = tk.Menu(toolbar, tearoff=0)
         toolbar.add_cascade(label="Help", menu=help_menu)
@@ -393,7 +388,7 @@ class MEMEPICApp:
         self.entry_slogan.bind("<KeyRelease>", lambda event: self.update_sample_text())
 
         self.var_transparency = IntVar()
-        Checkbutton(content_frame, text="Transparency", variable=self.var_transparency).grid(row=7, column=0, padx=5, pady=5, sticky='w')
+        Checkbutton(content_frame, text="Transparency", variable=self.var_transparency, command=self.update_sample_text).grid(row=7, column=0, padx=5, pady=5, sticky='w')
 
         Label(box_frame, text="WIDTH").grid(row=0, column=4, padx=5, pady=5, sticky='w')
         self.scale_box_width = Scale(box_frame, from_=0, to=100, orient=tk.HORIZONTAL, length=150, command=lambda value: self.update_sample_text())
@@ -403,9 +398,12 @@ class MEMEPICApp:
         Button(content_frame, text="COPY", command=self.copy_to_clipboard_method).grid(row=7, column=3, padx=5, pady=5, sticky='we')
         Button(content_frame, text="Reload", command=self.reload_image).grid(row=1, column=3, padx=5, pady=5, sticky='w')
 
+        self.label_status = Label(content_frame, text="", anchor='w')
+        self.label_status.grid(row=8, column=0, columnspan=4, padx=5, sticky='we')
+
     def select_image(self):
         initial_dir = os.path.dirname(self.entry_image_path.get()) if self.entry_image_path.get() else './IMAGES'
-        filename = filedialog.askopenfilename(initialdir=initial_dir, title="Select Image", filetypes=[("Image Files", "*.png *.jpg *.jpeg")])
+        filename = filedialog.askopenfilename(initialdir=initial_dir, title="Select Image", filetypes=[("Image Files", "*.png *.jpg *.jpeg *.gif *.webp")])
         if filename:
             self.entry_image_path.delete(0, tk.END)
             self.entry_image_path.insert(0, normalize_path(filename))
@@ -416,8 +414,11 @@ class MEMEPICApp:
         try:
             image_path = normalize_path(image_path)
             if os.path.exists(image_path):
-                self.image = Image.open(image_path).convert("RGBA")
-                self.update_image_label()
+                self.set_source(memepic_source.FileImageSource(image_path))
+                self.source.preview()  # Reduced-resolution decode for the preview only
+                self.source.start_full_decode()  # Full RGBA decode for SAVE/COPY, in the background
+                if self.first_frame_ms is not None:
+                    self.update_image_label()  # at startup the captioned preview is the first frame
                 self.update_sample_text()
             else:
                 print(f"Invalid image path: {image_path}")
@@ -428,6 +429,27 @@ class MEMEPICApp:
             self.image = Image.new('RGBA', (300, 300), (200, 200, 200, 255))  # Create a gray placeholder
             self.update_image_label()
         
+    def select_export_quality(self):
+        quality = simpledialog.askinteger("JPEG/WebP Quality", "Quality (1 - 100):", initialvalue=self.export_quality,
+                                          minvalue=1, maxvalue=100, parent=self.root)
+        if quality is not None:
+            self.export_quality = quality
+
+    def select_font(self):
+        filename = filedialog.askopenfilename(title="Select Font", filetypes=[("Font Files", "*.ttf *.otf *.ttc")])
+        if filename:
+            self.set_font(normalize_path(filename))
+
+    def set_font(self, font):
+        try:
+            if font:
+                memepic_truetype.load_font(font, 12)
+        except ValueError as e:
+            print(f"Error loading font: {e}")
+            return
+        self.font = font
+        self.update_sample_text()
+
     def set_output_folder(self):
         initial_dir = self.entry_output_folder.get() or os.path.expanduser("~")
         folder = filedialog.askdirectory(initialdir=initial_dir, title="Select Folder")
@@ -435,47 +457,88 @@ class MEMEPICApp:
             self.entry_output_folder.delete(0, tk.END)
             self.entry_output_folder.insert(0, folder)
 
+    def get_preview_proxy(self):
+        return self.source.preview()
+
     def update_sample_text(self):
-        if self.image:
-            slogan = self.entry_slogan.get("1.0", "end-1c")
-            font_size = self.scale_font_size.get()
-            font_thickness = self.scale_font_thickness.get()
-            font_color = self.color_var.get() or '255,255,255'
-            outline_color = self.outline_color_var.get() or '0,0,0'
-            outline_thickness = self.scale_outline_thickness.get() + 2 if self.scale_outline_thickness.get() > 0 else 0
-            box_color = self.box_color_var.get() or '0,0,0'
-            box_opacity = self.scale_box_opacity.get() / 100.0
-            use_box = box_opacity > 0
-            text_position = self.scale_text_position.get()
-            box_width = self.scale_box_width.get()
-
-            updated_image = self.add_slogan_to_image(self.image, slogan, font_color, font_thickness, font_size, outline_color, outline_thickness, box_color, box_opacity, use_box, text_position, box_width)
-            if updated_image:
-                if self.var_transparency.get() == 1:
-                    updated_image = self.make_transparent(updated_image)
-                updated_image = self.resize_image(updated_image, 300, 300)
+        if self.source:
+            key = self.render_key()
+            if key == self.preview_key:
+                return
+            self.preview_key = key
+            # Live preview renders onto a cached downscaled proxy in the background; SAVE/COPY render at full resolution
+            self.render_scheduler.submit(self.show_preview, self.get_preview_proxy(), self.current_spec(), self.source.size)
+
+    def show_preview(self, updated_image):
+        if updated_image:
+            with span('photoimage'):
                 self.updated_image = ImageTk.PhotoImage(updated_image)
-                self.img_label.config(image=self.updated_image)
-                self.img_label.image = self.updated_image
-            else:
-                print("Failed to update image with settings")
+            self.img_label.config(image=self.updated_image)
+            self.img_label.image = self.updated_image
+            if self.first_frame_ms is None:
+                self.first_frame_ms = (time.perf_counter() - STARTED) * 1000
+                print(f"First frame after {self.first_frame_ms:.0f} ms ({self.render_scheduler.rendered} preview render)")
+        else:
+            self.preview_key = None
+            print("Failed to update image with settings")
+
+    def poll_renders(self):
+        self.render_scheduler.poll()
+        self.report_exports()
+        self.root.after(RENDER_POLL_MS, self.poll_renders)
+
+    def show_timing_percentiles(self):
+        if not TRACER.durations:
+            messagebox.showinfo("Timing Percentiles", "No timings yet. Turn on Options > Trace Timings and edit the caption.")
+            return
+        messagebox.showinfo("Timing Percentiles", "\n".join(
+            f"{name}: p50 {row['p50_ms']:.1f} / p95 {row['p95_ms']:.1f} / p99 {row['p99_ms']:.1f} ms (n={row['count']})"
+            for name, row in TRACER.percentiles().items()))
+
+    def save_trace(self):
+        path = filedialog.asksaveasfilename(title="Save Trace", defaultextension=".json", filetypes=[("Chrome Trace", "*.json")])
+        if path:
+            TRACER.write_chrome_trace(path)
+            print(f"Trace saved to {path}")
+
+    def show_render_stats(self):
+        stats = self.render_scheduler.stats()
+        stats['first_frame_ms'] = self.first_frame_ms or 0.0
+        stats.update(self.layer_renderer.stats())
+        stats.update(self.key_cache.stats())
+        stats.update(self.export_queue.stats())
+        stats.update(self.clipboard.stats())
+        if self.font:
+            stats.update(memepic_truetype.ATLAS.stats())
+        if self.history is not None:
+            stats.update(self.history.stats())
+        messagebox.showinfo("Render Stats", "\n".join(f"{key}: {value:.1f}" if isinstance(value, float) else f"{key}: {value}" for key, value in stats.items()))
 
-    def make_transparent(self, image):
-        data = np.array(image)
-        alpha = data[:,:,3]
-        rgb = data[:,:,:3]
-        
-        # Make white background transparent
-        mask = (rgb == [255, 255, 255]).all(axis=2)
-        alpha[mask] = 0
-        
-        return Image.fromarray(np.concatenate([rgb, alpha.reshape(*alpha.shape, 1)], axis=2))
-                
     def apply_polaroid(self):
-        if self.image:
-            self.image = create_polaroid(self.image)
-            self.update_image_label()
-            self.update_sample_text()
+        if self.source:
+            # Recorded over the loaded image rather than replacing it, so it can be undone
+            self.show_edit(self.history.push(memepic_history.operation('polaroid', border_size=50)))
+
+    def edit_shortcut(self, action):
+        # Ctrl+Z/Ctrl+Y while typing the slogan belong to the text box, not the image history
+        if self.root.focus_get() is self.entry_slogan:
+            return
+        action()
+
+    def undo_edit(self):
+        if self.history is not None and self.history.can_undo():
+            self.show_edit(self.history.undo())
+
+    def redo_edit(self):
+        if self.history is not None and self.history.can_redo():
+            self.show_edit(self.history.redo())
+
+    def show_edit(self, source):
+        # The preview is rebuilt from the proxy; the full image is replayed in the background for SAVE/COPY
+        self.source = source
+        self.source.start_full_decode()
+        self.update_image_label()
+        self.update_sample_text()
         
     def update_color_label(self, var, canvas):
         color_rgb, color_hex = colorchooser.askcolor(title="Choose Color")
@@ -508,12 +571,22 @@ class MEMEPICApp:
             'on_top': self.on_top.get(),
             'window_position': [x, y],
             'transparency': self.var_transparency.get(),
+            'transparency_mode': self.transparency_mode.get(),
+            'transparency_tolerance': self.transparency_tolerance,
+            'export_format': self.export_format.get(),
+            'png_compress_level': self.png_compress_level.get(),
+            'export_quality': self.export_quality,
+            'export_sizes': self.export_options().config_sizes(),
             'slogan': self.entry_slogan.get("1.0", "end-1c"),
+            'font': self.font,
+            'history_mb': self.history_mb,
         }
         print(f"Saving settings: {config}")
         self.save_config(config)
 
     def load_settings(self):
+        # Widget values only; start_rendering loads the image and renders it once. Slider callbacks
+        # queued by .set() run later and find nothing changed (see update_sample_text).
         config = self.load_config()
         if config:
             print(f"Loaded settings: {config}")
@@ -529,11 +602,7 @@ class MEMEPICApp:
             self.entry_output_folder.insert(0, normalize_path(config.get('output_folder', '')))
             self.scale_text_position.set(config.get('text_position', 0))
             self.entry_image_path.delete(0, tk.END)
-            image_path = config.get('image_path', EXAMPLE_IMAGE)
-            if not os.path.isabs(image_path):
-                image_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), image_path)
-            full_image_path = normalize_path(os.path.abspath(image_path))
-            self.entry_image_path.insert(0, full_image_path)
+            self.entry_image_path.insert(0, config_image_path(config))
             self.on_top.set(config.get('on_top', 0))
             if self.on_top.get():
                 self.root.attributes('-topmost', True)
@@ -541,11 +610,19 @@ class MEMEPICApp:
             if window_position:
                 self.root.geometry(f"+{window_position[0]}+{window_position[1]}")
             self.var_transparency.set(config.get('transparency', 0))
-            self.load_image(full_image_path)
+            self.transparency_mode.set(config.get('transparency_mode', 'all'))
+            self.transparency_tolerance = config.get('transparency_tolerance', 0)
+            self.font = config.get('font', '')
+            self.history_mb = config.get('history_mb', 256)
+            export_options = ExportOptions.from_config(config)
+            self.export_format.set(export_options.format)
+            self.png_compress_level.set(export_options.compress_level)
+            self.export_quality = export_options.quality
+            for size, variable in self.save_sizes.items():
+                variable.set(size in export_options.config_sizes())
             self.entry_slogan.delete("1.0", tk.END)
             self.entry_slogan.insert("1.0", config.get('slogan', ''))
             self.update_canvas_colors()
-            self.update_sample_text()
         else:
             print("No settings file found. Loading defaults.")
             self.load_default_settings()
@@ -564,11 +641,9 @@ class MEMEPICApp:
         self.entry_output_folder.insert(0, normalize_path(default_output_folder))
         self.scale_text_position.set(0)
         self.entry_image_path.delete(0, tk.END)
-        full_image_path = normalize_path(os.path.abspath(os.path.join(os.path.dirname(__file__), EXAMPLE_IMAGE)))
-        self.entry_image_path.insert(0, full_image_path)
+        self.entry_image_path.insert(0, config_image_path({}))
         self.on_top.set(0)
         self.var_transparency.set(0)
-        self.load_image(full_image_path)
         self.update_canvas_colors()
     
     def update_canvas_colors(self):
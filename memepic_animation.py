@@ -0,0 +1,140 @@
+"""Animated GIF/APNG/WebP captioning: the caption is rasterized once and composited onto each frame."""
+import os
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from memepic_export import reserve_output_path
+from memepic_render import CaptionSpec, draw_caption, frame_to_image, layout_caption, parse_color
+from memepic_transparency import key_in_place
+
+# Pillow format -> extension of the animated container it is written back to
+ANIMATED_FORMATS = {'GIF': '.gif', 'PNG': '.png', 'WEBP': '.webp'}
+APNG_BLEND_SOURCE = 0
+
+
+def is_animated(image_path):
+    with Image.open(image_path) as image:
+        return image.format in ANIMATED_FORMATS and getattr(image, 'n_frames', 1) > 1
+
+
+def caption_overlay(width, height, spec):
+    # The box, outline and text as one RGBA tile plus its offset in the frame. The box is stored
+    # with alpha = opacity, so compositing it matches blend_box; text pixels are opaque.
+    layout = layout_caption(width, height, spec)
+    if layout is None:
+        return None
+    layer = np.zeros((height, width, 4), np.uint8)
+    if spec.use_box:
+        left, top, right, bottom = layout.box_rect(spec.box_width)
+        layer[top:bottom + 1, left:right + 1] = parse_color(spec.box_color) + (int(round(spec.box_opacity * 255)),)
+    draw_caption(layer, layout, CaptionSpec.from_dict(dict(spec.to_dict(), box_opacity=0.0)))
+    x, y, tile_width, tile_height = cv2.boundingRect(layer[:, :, 3])
+    if tile_width == 0 or tile_height == 0:
+        return None
+    return layer[y:y + tile_height, x:x + tile_width].copy(), (x, y)
+
+
+def composite_overlay(frame, overlay):
+    if overlay is None:
+        return frame
+    tile, (x, y) = overlay
+    region = frame[y:y + tile.shape[0], x:x + tile.shape[1]]
+    alpha = tile[:, :, 3:4].astype(np.uint16)
+    inverse = 255 - alpha
+    region[:, :, :3] = (tile[:, :, :3] * alpha + region[:, :, :3] * inverse + 127) // 255
+    region[:, :, 3:] = alpha + (region[:, :, 3:] * inverse + 127) // 255
+    return frame
+
+
+def frame_disposal(image):
+    if image.format == 'GIF':
+        return image.disposal_method
+    return image.info.get('disposal', 0)
+
+
+def iter_frames(image, durations, disposals):
+    # One full (already disposed and blended) RGBA frame at a time. Each frame's duration and
+    # disposal are appended before it is yielded, so the encoder can index them by frame number.
+    for index in range(getattr(image, 'n_frames', 1)):
+        image.seek(index)
+        frame = np.array(image.convert("RGBA"))  # loading the frame also fills in its info
+        durations.append(image.info.get('duration', 100))
+        disposals.append(frame_disposal(image))
+        yield frame
+
+
+def caption_frames(frames, overlay, spec, workers=1):
+    def caption(frame):
+        composite_overlay(frame, overlay)
+        if spec.transparency:
+            key_in_place(frame, spec.transparency_tolerance, spec.transparency_mode)
+        return frame_to_image(frame)
+
+    if workers <= 1:
+        for frame in frames:
+            yield caption(frame)
+        return
+    # In order, with at most 2 * workers frames in flight so memory stays flat
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="memepic-frames") as pool:
+        window = deque()
+        for frame in frames:
+            window.append(pool.submit(caption, frame))
+            if len(window) >= 2 * workers:
+                yield window.popleft().result()
+        while window:
+            yield window.popleft().result()
+
+
+def render_animation(source_path, output_path, spec, options=None, workers=1):
+    # Writes to a temp file and renames it over `output_path`. Returns the number of frames read.
+    with Image.open(source_path) as image:
+        pillow_format = image.format
+        if pillow_format not in ANIMATED_FORMATS:
+            raise ValueError(f"Not an animated GIF/PNG/WebP: {source_path}")
+        durations, disposals = [], []
+        overlay = caption_overlay(image.width, image.height, spec)
+        frames = caption_frames(iter_frames(image, durations, disposals), overlay, spec, workers)
+        first = next(frames)
+        save_arguments = {'save_all': True, 'append_images': frames, 'duration': durations}
+        if 'loop' in image.info:
+            # A GIF without a loop count plays once; passing loop=0 would make it loop forever
+            save_arguments['loop'] = image.info['loop']
+        if pillow_format in ('GIF', 'PNG'):
+            save_arguments['disposal'] = disposals
+        if pillow_format == 'PNG':
+            # Frames are complete images, so each one replaces its region rather than blending over it.
+            # Pillow's APNG writer walks append_images twice, so it needs a list rather than the stream.
+            save_arguments['blend'] = APNG_BLEND_SOURCE
+            save_arguments['append_images'] = list(frames)
+        if pillow_format == 'WEBP' and options is not None:
+            save_arguments['quality'] = options.quality
+        temp_path = f"{output_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            first.save(temp_path, pillow_format, **save_arguments)
+            os.replace(temp_path, output_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return len(durations)
+
+
+def animated_extension(image_path):
+    with Image.open(image_path) as image:
+        return ANIMATED_FORMATS[image.format]
+
+
+def export_animation(source_path, output_folder, spec, options=None, prefix="meme", workers=1):
+    os.makedirs(output_folder, exist_ok=True)
+    file_path = reserve_output_path(output_folder, prefix, animated_extension(source_path))
+    try:
+        render_animation(source_path, file_path, spec, options, workers)
+    except Exception:
+        os.remove(file_path)
+        raise
+    return file_path, os.path.getsize(file_path)
@@ -0,0 +1,822 @@
+"""Micro-benchmarks for the caption render pipeline (headless, synthetic images)."""
+import io
+import json
+import math
+import platform
+import asyncio
+import http.client
+import threading
+import os
+import subprocess
+import sys
+import time
+import tempfile
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from memepic_animation import caption_frames, caption_overlay, iter_frames, render_animation
+from memepic_cache import RenderCache, render_file_cached
+from memepic_clipboard import ClipboardPipeline, MemoryClipboardBackend, clipboard_image
+from memepic_export import ExportOptions, size_pyramid, size_suffix, sized_paths, write_atomic, write_sizes
+from memepic_history import EditHistory, image_nbytes, operation
+from memepic_layers import LayeredRenderer
+from memepic_server import RenderService
+from memepic_truetype import ATLAS, load_font
+from memepic_transparency import KeyMaskCache, key_in_place
+from memepic_scheduler import RenderScheduler
+from memepic_source import PROXY_SIZE, FileImageSource, ImageSource
+from memepic_testing import SAMPLE_SLOGAN, peak_allocation, preview_layout_error
+from memepic_render import (CaptionSpec, FONT, OUTLINE_ENGINES, PREVIEW_SIZE, add_slogan_to_image, create_polaroid,
+                            draw_caption, fit_candidates, make_transparent,
+                            fit_font_scale, frame_to_image, layout_caption, make_preview_proxy,
+                            render_frame, render_preview, resize_image, source_array, text_size)
+
+# Tried in order by 'bench text'; bare names are looked up in the system font folders
+BENCH_FONTS = ('impact.ttf', 'Impact.ttf', 'arialbd.ttf', 'DejaVuSans-Bold.ttf', 'LiberationSans-Bold.ttf')
+
+
+def synthetic_image(width, height, seed=0):
+    rng = np.random.default_rng(seed)
+    data = rng.integers(0, 256, (height, width, 4), dtype=np.uint8)
+    data[:, :, 3] = 255
+    return Image.fromarray(data)
+
+
+def time_call(func, repeats=5, warmup=1):
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return {'best_ms': timings[0] * 1000, 'median_ms': timings[len(timings) // 2] * 1000}
+
+
+def print_table(results, columns):
+    print("  ".join(f"{column:>12}" for column in columns))
+    for row in results:
+        cells = []
+        for column in columns:
+            value = row.get(column, '')
+            cells.append(f"{value:>12.2f}" if isinstance(value, float) else f"{value!s:>12}")
+        print("  ".join(cells))
+
+
+def bench_outline(size=(1920, 1080), thicknesses=(0, 3, 4, 5, 6, 7), positions=(0, 50, 100), repeats=5):
+    # Positions 0 and 100 put the outline across the frame edge, which the compat engine clips
+    image = synthetic_image(*size)
+    results = []
+    for position in positions:
+        for thickness in thicknesses:
+            for engine in OUTLINE_ENGINES:
+                kernels = ('square', 'round') if engine == 'dilate' else ('square',)
+                for kernel in kernels:
+                    spec = CaptionSpec(SAMPLE_SLOGAN, font_scale=3, font_thickness=4, outline_thickness=thickness,
+                                       text_position=position, outline_engine=engine, outline_kernel=kernel)
+                    timing = time_call(lambda: add_slogan_to_image(image, spec), repeats)
+                    results.append({'position': position, 'thickness': thickness, 'engine': engine,
+                                    'kernel': kernel, **timing})
+    print_table(results, ('position', 'thickness', 'engine', 'kernel', 'best_ms', 'median_ms'))
+    return results
+
+
+def bench_preview(sizes=((1920, 1080), (6000, 4000)), repeats=5):
+    results = []
+    for size in sizes:
+        image = Image.new('RGBA', size, (128, 128, 128, 255))
+        proxy = make_preview_proxy(image)
+        for lines in (1, 3):
+            spec = CaptionSpec("\n".join(SAMPLE_SLOGAN.split("\n")[:lines]), font_scale=5, font_thickness=6,
+                               outline_thickness=5, box_opacity=0.5, box_width=80, text_position=90)
+            full = time_call(lambda: resize_image(add_slogan_to_image(image, spec), PREVIEW_SIZE, PREVIEW_SIZE), repeats)
+            fast = time_call(lambda: render_preview(proxy, spec, image.size), repeats)
+            results.append({'size': f"{size[0]}x{size[1]}", 'lines': lines, 'full_ms': full['median_ms'],
+                            'proxy_ms': fast['median_ms'], 'bbox_err_px': preview_layout_error(image, spec)})
+    print_table(results, ('size', 'lines', 'full_ms', 'proxy_ms', 'bbox_err_px'))
+    return results
+
+
+def bench_scheduler(size=(6000, 4000), ticks=100, tick_interval=0.005, repeats=1):
+    # Simulate dragging the position slider: one preview request every tick_interval seconds
+    image = synthetic_image(*size)
+    proxy = make_preview_proxy(image)
+    results = []
+    for _ in range(repeats):
+        scheduler = RenderScheduler(render_preview)
+        frames = []
+        start = time.perf_counter()
+        for tick in range(ticks):
+            spec = CaptionSpec(SAMPLE_SLOGAN, font_scale=5, font_thickness=6, outline_thickness=5, text_position=tick % 101)
+            scheduler.submit(frames.append, proxy, spec, image.size)
+            scheduler.poll()
+            time.sleep(tick_interval)
+        scheduler.wait_idle()
+        scheduler.poll()
+        elapsed = time.perf_counter() - start
+        scheduler.close()
+        results.append({**scheduler.stats(), 'elapsed_ms': elapsed * 1000})
+    print_table(results, ('submitted', 'rendered', 'delivered', 'dropped', 'latency_ms_avg', 'latency_ms_max', 'elapsed_ms'))
+    return results
+
+
+def bench_layers(size=(6000, 4000), repeats=5):
+    # Replay typical single-parameter edits against the cached layers and against a from-scratch render
+    image = synthetic_image(*size)
+    proxy = make_preview_proxy(image)
+    spec = CaptionSpec(SAMPLE_SLOGAN, font_scale=5, font_thickness=6, outline_thickness=5, box_opacity=0.5, box_width=80)
+    edits = [
+        ('font_color', ['255,255,255', '255,0,0', '0,255,0']),
+        ('text_position', [10, 50, 90]),
+        ('box_opacity', [0.3, 0.5, 0.7]),
+        ('transparency', [False, True]),
+    ]
+    results = []
+    for field, values in edits:
+        renderer = LayeredRenderer()
+        renderer.render_preview(proxy, spec, image.size)
+        variants = [CaptionSpec.from_dict({**spec.to_dict(), field: value}) for value in values]
+        layered = time_call(lambda: [renderer.render_preview(proxy, variant, image.size) for variant in variants], repeats)
+        scratch = time_call(lambda: [render_preview(proxy, variant, image.size) for variant in variants], repeats)
+        stats = renderer.stats()
+        results.append({'edit': field, 'layered_ms': layered['median_ms'] / len(values),
+                        'scratch_ms': scratch['median_ms'] / len(values),
+                        'text_hits': stats.get('text_hit_rate', 0.0), 'box_hits': stats.get('box_hit_rate', 0.0)})
+    print_table(results, ('edit', 'layered_ms', 'scratch_ms', 'text_hits', 'box_hits'))
+    return results
+
+
+def find_bench_font(candidates=BENCH_FONTS):
+    for font in candidates:
+        try:
+            load_font(font, 12)
+            return font
+        except ValueError:
+            continue
+    return None
+
+
+def bench_text(size=(1920, 1080), font=None, repeats=3):
+    # Per-keystroke cost of typing SAMPLE_SLOGAN: the layered preview (what the app redraws on each
+    # key) and the full-resolution render, Hershey vs a TrueType font drawn from the glyph atlas
+    font = font or find_bench_font()
+    if font is None:
+        print(f"No TrueType font found (tried {', '.join(BENCH_FONTS)}); skipping")
+        return []
+    image = synthetic_image(*size)
+    proxy = make_preview_proxy(image)
+    prefixes = [SAMPLE_SLOGAN[:length] for length in range(1, len(SAMPLE_SLOGAN) + 1)]
+    results = []
+    for name, face in (('hershey', ''), ('truetype', font)):
+        specs = [CaptionSpec(prefix, font_scale=3, font_thickness=2, outline_thickness=4, font=face) for prefix in prefixes]
+        ATLAS.clear()
+        start = time.perf_counter()
+        render_frame(image, specs[-1])
+        first_ms = (time.perf_counter() - start) * 1000
+        renderer = LayeredRenderer()
+        preview = time_call(lambda: [renderer.render_preview(proxy, spec, image.size) for spec in specs], repeats)
+        renderer.cache.clear()
+        full = time_call(lambda: [render_frame(image, spec) for spec in specs], repeats)
+        row = {'text': name, 'cold_full_ms': first_ms, 'preview_ms': preview['median_ms'] / len(specs),
+               'full_ms': full['median_ms'] / len(specs)}
+        if face:
+            row['glyph_hits'] = ATLAS.stats()['glyph_hit_rate']
+        results.append(row)
+    print(f"font: {font}")
+    print_table(results, ('text', 'cold_full_ms', 'preview_ms', 'full_ms', 'glyph_hits'))
+    return results
+
+
+def fit_font_scale_linear(lines, font_scale, font_thickness, image_width):
+    # The original shrink loop, kept here as the baseline for 'bench layout'
+    text_width = max(cv2.getTextSize(line, FONT, font_scale, font_thickness)[0][0] for line in lines)
+    cv2.getTextSize('Tg', FONT, font_scale, font_thickness)
+    while text_width > image_width and font_scale > 0.5:
+        font_scale -= 0.1
+        cv2.getTextSize('Tg', FONT, font_scale, font_thickness)
+        text_width = max(cv2.getTextSize(line, FONT, font_scale, font_thickness)[0][0] for line in lines)
+    return font_scale
+
+
+def clear_layout_caches():
+    for cached in (text_size, fit_candidates, fit_font_scale):
+        cached.cache_clear()
+
+
+def bench_layout(line_counts=(1, 5, 10, 25, 50), image_width=1080, repeats=5):
+    results = []
+    words = SAMPLE_SLOGAN.split()
+    for count in line_counts:
+        lines = tuple(" ".join(words[(i + j) % len(words)] for j in range(6)) + f" {i}" for i in range(count))
+        spec = CaptionSpec("\n".join(lines), font_scale=5, font_thickness=6)
+        linear = time_call(lambda: fit_font_scale_linear(lines, 5, 6, image_width), repeats)
+        cold = time_call(lambda: (clear_layout_caches(), layout_caption(image_width, 1920, spec)), repeats)
+        warm = time_call(lambda: layout_caption(image_width, 1920, spec), repeats)
+        results.append({'lines': count, 'linear_ms': linear['median_ms'], 'cold_ms': cold['median_ms'],
+                        'warm_ms': warm['median_ms']})
+    print_table(results, ('lines', 'linear_ms', 'cold_ms', 'warm_ms'))
+    return results
+
+
+def make_transparent_legacy(image):
+    # The original MEMEPICApp.make_transparent, kept as the baseline for 'bench copies' and 'bench transparency'
+    data = np.array(image)
+    alpha = data[:,:,3]
+    rgb = data[:,:,:3]
+    mask = (rgb == [255, 255, 255]).all(axis=2)
+    alpha[mask] = 0
+    return Image.fromarray(np.concatenate([rgb, alpha.reshape(*alpha.shape, 1)], axis=2))
+
+
+class StageAllocations:
+    # Per-stage allocation accounting. tracemalloc sees NumPy buffers and bytes objects; Pillow
+    # allocates image memory in C blocks, so those are counted from Pillow's allocator stats
+    # (an upper bound: every block is counted at the full block size).
+
+    def __init__(self, frame_bytes):
+        self.frame_bytes = frame_bytes
+        self.rows = []
+
+    @staticmethod
+    def pillow_blocks():
+        stats = Image.core.get_stats()
+        return stats['allocated_blocks'] + stats['reused_blocks']
+
+    @contextmanager
+    def stage(self, name):
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        blocks_before = self.pillow_blocks()
+        try:
+            yield
+        finally:
+            _, peak = tracemalloc.get_traced_memory()
+            pillow_bytes = (self.pillow_blocks() - blocks_before) * Image.core.get_block_size()
+            if started:
+                tracemalloc.stop()
+            allocated = max(0, peak - before)
+            self.rows.append({'stage': name, 'numpy_frames': allocated / self.frame_bytes,
+                              'pillow_frames': pillow_bytes / self.frame_bytes})
+
+    def total_frames(self):
+        return sum(row['numpy_frames'] + row['pillow_frames'] for row in self.rows)
+
+
+def bench_copies(size=(6000, 4000), repeats=1):
+    # Count full-frame copies for one SAVE with transparency on: the old PIL<->NumPy round trips
+    # against the in-place pipeline (render_frame on a cached read-only source view).
+    image = synthetic_image(*size)
+    spec = CaptionSpec(SAMPLE_SLOGAN, font_scale=5, font_thickness=6, outline_thickness=5, box_opacity=0.5,
+                       transparency=True)
+    frame_bytes = size[0] * size[1] * 4
+
+    old = StageAllocations(frame_bytes)
+    with old.stage('image.copy'):
+        working = image.copy()
+    with old.stage('np.array'):
+        working_np = np.array(working)
+    with old.stage('draw'):
+        draw_caption(working_np, layout_caption(size[0], size[1], spec), spec)
+    with old.stage('fromarray'):
+        processed = Image.fromarray(working_np)
+    with old.stage('processed.copy'):
+        saved = processed.copy()
+    with old.stage('make_transparent'):
+        saved = make_transparent_legacy(saved)
+    with old.stage('encode'):
+        saved.save(io.BytesIO(), "PNG", compress_level=1)
+    del working, working_np, processed, saved
+
+    new = StageAllocations(frame_bytes)
+    with new.stage('source_array'):
+        source = source_array(image)  # cached per loaded image in the app
+    with new.stage('render_frame'):
+        frame = render_frame(source, spec)
+    with new.stage('frame_to_image'):
+        saved = frame_to_image(frame)
+    with new.stage('encode'):
+        saved.save(io.BytesIO(), "PNG", compress_level=1)
+
+    results = [{'pipeline': 'old', **row} for row in old.rows] + [{'pipeline': 'new', **row} for row in new.rows]
+    print_table(results, ('pipeline', 'stage', 'numpy_frames', 'pillow_frames'))
+    source_frames = new.rows[0]['numpy_frames'] + new.rows[0]['pillow_frames']
+    print(f"Full-frame allocations per SAVE: old {old.total_frames():.1f}, new {new.total_frames() - source_frames:.1f} "
+          f"(plus {source_frames:.1f} once per loaded image for the read-only source view)")
+    return results
+
+
+def bench_roi_memory(sizes=((1000, 1000), (4000, 3000), (8000, 6000), (12000, 8500)), repeats=1):
+    # Peak memory allocated while drawing box + outline + fill onto an already-decoded frame. With
+    # ROI-bounded drawing it tracks the caption's area and stays flat as the frame grows.
+    results = []
+    for width, height in sizes:
+        image_np = np.zeros((height, width, 4), np.uint8)
+        spec = CaptionSpec(SAMPLE_SLOGAN, font_scale=5, font_thickness=6, outline_thickness=5, box_opacity=0.5,
+                           box_width=60, text_position=80)
+        layout = layout_caption(width, height, spec)
+        left, top, right, bottom = layout.box_rect(spec.box_width)
+        _, peak = peak_allocation(lambda: draw_caption(image_np, layout, spec))
+        timing = time_call(lambda: draw_caption(image_np, layout, spec), repeats)
+        results.append({'megapixels': width * height / 1e6, 'frame_mb': image_np.nbytes / 2 ** 20,
+                        'caption_mb': (right - left + 1) * (bottom - top + 1) * 4 / 2 ** 20,
+                        'peak_mb': peak / 2 ** 20, 'median_ms': timing['median_ms']})
+    print_table(results, ('megapixels', 'frame_mb', 'caption_mb', 'peak_mb', 'median_ms'))
+    return results
+
+
+def bench_transparency(sizes=((3840, 2160), (7680, 4320)), repeats=5):
+    results = []
+    for width, height in sizes:
+        image = synthetic_image(width, height)
+        frame = np.array(image)
+        frame[: height // 3] = 255  # a white band so there is something to key
+        image = Image.fromarray(frame)
+        cache = KeyMaskCache()
+        cases = [
+            ('legacy', lambda: make_transparent_legacy(image)),
+            ('exact', lambda: key_in_place(frame, 0, 'all')),
+            ('tolerance', lambda: key_in_place(frame, 16, 'all')),
+            ('border', lambda: key_in_place(frame, 0, 'border')),
+            ('cached', lambda: cache.key_in_place('frame', frame, 0, 'border')),
+        ]
+        for name, func in cases:
+            timing = time_call(func, repeats)
+            _, peak = peak_allocation(func)
+            results.append({'size': f"{width}x{height}", 'engine': name, 'median_ms': timing['median_ms'],
+                            'peak_mb': peak / 2 ** 20})
+    print_table(results, ('size', 'engine', 'median_ms', 'peak_mb'))
+    return results
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 2 ** 20 if sys.platform == 'darwin' else peak / 1024
+
+
+def first_preview_eager(path):
+    start = time.perf_counter()
+    make_preview_proxy(Image.open(path).convert("RGBA"), PROXY_SIZE)
+    return time.perf_counter() - start, peak_rss_mb()
+
+
+def first_preview_lazy(path):
+    start = time.perf_counter()
+    FileImageSource(path).preview()
+    return time.perf_counter() - start, peak_rss_mb()
+
+
+def bench_decode(size=(6000, 4000), repeats=3):
+    # Time-to-first-preview and peak resident memory, each measured in a fresh process so the
+    # RSS high-water mark belongs to that path alone
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        image = synthetic_image(*size).convert("RGB")
+        paths = {'jpeg': os.path.join(folder, 'source.jpg'), 'png': os.path.join(folder, 'source.png')}
+        image.save(paths['jpeg'], quality=90)
+        image.save(paths['png'], compress_level=1)
+        del image
+        for kind, path in paths.items():
+            for name, func in (('eager', first_preview_eager), ('lazy', first_preview_lazy)):
+                runs = []
+                for _ in range(repeats):
+                    with ProcessPoolExecutor(max_workers=1) as pool:
+                        runs.append(pool.submit(func, path).result())
+                runs.sort()
+                seconds, rss = runs[len(runs) // 2]
+                results.append({'format': kind, 'path': name, 'first_preview_ms': seconds * 1000, 'peak_rss_mb': rss})
+    print_table(results, ('format', 'path', 'first_preview_ms', 'peak_rss_mb'))
+    return results
+
+
+def export_sizes_independent(path, folder, options):
+    # Every size as its own SAVE: a full render, resized from full resolution, then encoded
+    start = time.perf_counter()
+    spec = CaptionSpec(SAMPLE_SLOGAN, outline_thickness=4)
+    for size in options.sizes:
+        rendered = frame_to_image(render_frame(source_array(Image.open(path)), spec))
+        level = next(size_pyramid(rendered, (size,)))[1]
+        write_atomic(level, os.path.join(folder, f"independent{size_suffix(size)}{options.extension}"), options)
+    return time.perf_counter() - start, peak_rss_mb()
+
+
+def export_sizes_pyramid(path, folder, options):
+    start = time.perf_counter()
+    spec = CaptionSpec(SAMPLE_SLOGAN, outline_thickness=4)
+    rendered = frame_to_image(render_frame(source_array(Image.open(path)), spec))
+    write_sizes(rendered, sized_paths(os.path.join(folder, f"pyramid{options.extension}"), options), options)
+    return time.perf_counter() - start, peak_rss_mb()
+
+
+def bench_sizes(size=(4000, 3000), sizes='full,1080,512,300', repeats=3):
+    # One SAVE in several sizes: N independent renders vs one render, a downsampling pyramid and
+    # parallel encodes. Each run is a fresh process, so peak RSS covers that path alone.
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'source.jpg')
+        synthetic_image(*size).convert("RGB").save(path, quality=90)
+        for format in ('png', 'jpeg'):
+            options = ExportOptions(format, sizes=sizes)
+            for name, func in (('independent', export_sizes_independent), ('pyramid', export_sizes_pyramid)):
+                runs = []
+                for _ in range(repeats):
+                    with ProcessPoolExecutor(max_workers=1) as pool:
+                        runs.append(pool.submit(func, path, folder, options).result())
+                runs.sort()
+                seconds, rss = runs[len(runs) // 2]
+                results.append({'format': format, 'path': name, 'outputs': len(options.sizes),
+                                'total_ms': seconds * 1000, 'peak_rss_mb': rss})
+    print_table(results, ('format', 'path', 'outputs', 'total_ms', 'peak_rss_mb'))
+    return results
+
+
+def bench_history(size=(6000, 4000), steps=8, checkpoint_every=4, repeats=3):
+    # Polaroid applied `steps` times, then undone once. 'snapshots' keeps every step's bitmap (an
+    # undo stack of images); 'history' keeps operations plus a checkpoint every `checkpoint_every`
+    # steps. Memory is the bytes each keeps beyond the source, per step.
+    source = ImageSource(synthetic_image(*size))
+    polaroid = operation('polaroid', border_size=50)
+    results = []
+
+    snapshots = []
+    def apply_snapshots():
+        snapshots[:] = [source.full()]
+        for _ in range(steps):
+            snapshots.append(create_polaroid(snapshots[-1]))
+    timing = time_call(apply_snapshots, repeats)
+    results.append({'path': 'snapshots', 'steps': steps, 'mb_per_step': sum(map(image_nbytes, snapshots[1:])) / steps / 2 ** 20,
+                    'apply_ms': timing['median_ms'], 'undo_preview_ms': 0.0, 'undo_full_ms': 0.0})
+    snapshots.clear()
+
+    histories = []
+    def apply_history():
+        history = EditHistory(source, checkpoint_every)
+        for _ in range(steps):
+            edited = history.push(polaroid)
+        edited.full()
+        histories[:] = [history]
+    timing = time_call(apply_history, repeats)
+    history = histories[0]
+    undo_preview = time_call(lambda: (history.undo().preview(), history.redo()), repeats)
+    undo_full = time_call(lambda: (history.undo().full(), history.redo()), repeats)
+    results.append({'path': 'history', 'steps': steps, 'mb_per_step': history.stats()['history_mb_per_step'],
+                    'apply_ms': timing['median_ms'], 'undo_preview_ms': undo_preview['median_ms'],
+                    'undo_full_ms': undo_full['median_ms']})
+    print_table(results, ('path', 'steps', 'mb_per_step', 'apply_ms', 'undo_preview_ms', 'undo_full_ms'))
+    return results
+
+
+def copy_to_clipboard_legacy(source, spec, folder):
+    # The old COPY path: full re-render, PNG written to disk and read back for the clipboard
+    temp_file = os.path.join(folder, 'temp_image.png')
+    clipboard_image(frame_to_image(render_frame(source, spec)), spec.transparency).save(temp_file, format="PNG")
+    with open(temp_file, 'rb') as f:
+        return len(f.read())
+
+
+def bench_clipboard(sizes=((1920, 1080), (6000, 4000)), repeats=5):
+    results = []
+    spec = CaptionSpec(SAMPLE_SLOGAN, outline_thickness=4)
+    with tempfile.TemporaryDirectory() as folder:
+        for width, height in sizes:
+            source = source_array(synthetic_image(width, height))
+            pipeline = ClipboardPipeline(MemoryClipboardBackend())
+            render = lambda: frame_to_image(render_frame(source, spec))
+            fresh = iter(range(10 ** 9))
+            cases = [
+                ('legacy', lambda: copy_to_clipboard_legacy(source, spec, folder)),
+                ('memory', lambda: pipeline.copy(next(fresh), render, spec.transparency)),
+                ('repeat', lambda: pipeline.copy('same', render, spec.transparency)),
+            ]
+            for name, func in cases:
+                timing = time_call(func, repeats)
+                results.append({'size': f"{width}x{height}", 'path': name, 'median_ms': timing['median_ms'],
+                                'png_kb': func() / 1024})
+    print_table(results, ('size', 'path', 'median_ms', 'png_kb'))
+    return results
+
+
+def start_render_service(workers=2):
+    # A RenderService on an ephemeral localhost port, on its own event loop thread
+    service = RenderService(workers=workers)
+    bound = []
+    ready = threading.Event()
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(service.serve('127.0.0.1', 0, lambda address: (bound.append(address), ready.set())))
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            remaining = asyncio.all_tasks(loop)
+            for pending in remaining:
+                pending.cancel()
+            if remaining:
+                loop.run_until_complete(asyncio.gather(*remaining, return_exceptions=True))
+            loop.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    ready.wait(30)
+    return service, bound[0][1], lambda: (loop.call_soon_threadsafe(task.cancel), thread.join(30))
+
+
+def bench_server(size=(1920, 1080), requests=20, repeats=1):
+    buffer = io.BytesIO()
+    synthetic_image(*size).convert("RGB").save(buffer, "JPEG", quality=90)
+    upload = buffer.getvalue()
+    service, port, stop = start_render_service()
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+
+    def post(slogan, headers=None):
+        connection.request('POST', f'/render?slogan={slogan}&outline_thickness=4&format=jpeg', upload, headers or {})
+        response = connection.getresponse()
+        response.read()
+        return response.status, response.getheader('ETag')
+
+    results = []
+    try:
+        etags = []
+        for name in ('render', 'cached', 'not_modified'):
+            start = time.perf_counter()
+            for index in range(requests):
+                slogan = f"CASE+{index}"
+                if name == 'render':
+                    status, etag = post(slogan)
+                    etags.append(etag)
+                else:
+                    status, _ = post(slogan, {'If-None-Match': etags[index]} if name == 'not_modified' else None)
+            elapsed = time.perf_counter() - start
+            results.append({'requests': name, 'status': status, 'avg_ms': elapsed / requests * 1000,
+                            'req_per_sec': requests / elapsed})
+        connection.request('GET', '/metrics')
+        metrics = connection.getresponse().read().decode()
+        hits = [line for line in metrics.splitlines() if line.startswith('memepic_cache_hits_total')]
+        print(hits[0])
+    finally:
+        connection.close()
+        stop()
+    print_table(results, ('requests', 'status', 'avg_ms', 'req_per_sec'))
+    return results
+
+
+def bench_render_cache(size=(4000, 3000), repeats=3):
+    results = []
+    spec = CaptionSpec(SAMPLE_SLOGAN, outline_thickness=4)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'source.jpg')
+        synthetic_image(*size).convert("RGB").save(path, quality=90)
+        for format in ('png', 'jpeg'):
+            options = ExportOptions(format)
+            cache = RenderCache(os.path.join(folder, 'cache'))
+            cases = [('cold', lambda: (cache.clear(), render_file_cached(cache, path, spec, options))), ('warm', lambda: render_file_cached(cache, path, spec, options))]
+            for name, func in cases:
+                timing = time_call(func, repeats)
+                results.append({'format': format, 'cache': name, 'median_ms': timing['median_ms']})
+    print_table(results, ('format', 'cache', 'median_ms'))
+    return results
+
+
+def bench_animation(size=(1280, 720), frame_count=60, repeats=3):
+    # Caption stage only (decode + composite, no encode), then the full GIF/WebP write
+    results = []
+    spec = CaptionSpec(SAMPLE_SLOGAN, outline_thickness=4, box_opacity=0.5)
+    with tempfile.TemporaryDirectory() as folder:
+        # Smooth moving gradients: realistic decode cost, unlike noise
+        x, y = np.meshgrid(np.arange(size[0]), np.arange(size[1]))
+        frames = [Image.fromarray(np.dstack([(x + 8 * index) % 256, (y + 4 * index) % 256, (x + y) // 8 % 256]).astype(np.uint8))
+                  for index in range(frame_count)]
+        path = os.path.join(folder, 'source.webp')
+        frames[0].save(path, 'WEBP', save_all=True, append_images=frames[1:], duration=40, quality=80)
+        gif_path = os.path.join(folder, 'source.gif')
+        frames[0].save(gif_path, 'GIF', save_all=True, append_images=frames[1:], duration=40)
+        del frames
+
+        def per_frame_render():
+            with Image.open(path) as image:
+                for frame in iter_frames(image, [], []):
+                    render_frame(frame, spec)
+
+        def shared_overlay(workers):
+            with Image.open(path) as image:
+                overlay = caption_overlay(image.width, image.height, spec)
+                for _ in caption_frames(iter_frames(image, [], []), overlay, spec, workers):
+                    pass
+
+        def decode_only():
+            with Image.open(path) as image:
+                for _ in iter_frames(image, [], []):
+                    pass
+
+        cases = [
+            ('decode_only', decode_only),
+            ('per_frame_render', per_frame_render),
+            ('shared_overlay', lambda: shared_overlay(1)),
+            ('shared_overlay_4_workers', lambda: shared_overlay(4)),
+            ('write_webp', lambda: render_animation(path, os.path.join(folder, 'out.webp'), spec, workers=4)),
+            ('write_gif', lambda: render_animation(gif_path, os.path.join(folder, 'out.gif'), spec, workers=4)),
+        ]
+        for name, func in cases:
+            timing = time_call(func, repeats, warmup=0)
+            _, peak = peak_allocation(func)
+            results.append({'path': name, 'median_ms': timing['median_ms'], 'ms_per_frame': timing['median_ms'] / frame_count,
+                            'peak_mb': peak / 2 ** 20})
+    print_table(results, ('path', 'median_ms', 'ms_per_frame', 'peak_mb'))
+    return results
+
+
+def bench_startup(size=(4000, 3000), repeats=5):
+    # Time to the first captioned preview, each run in a fresh interpreter so imports are cold.
+    # wall_ms includes interpreter startup; the rest are measured inside the child.
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'memepic_startup.py')
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        image_path = os.path.join(folder, 'source.jpg')
+        synthetic_image(*size).convert("RGB").save(image_path, quality=90)
+        config_path = os.path.join(folder, 'config.json')
+        with open(config_path, 'w') as file:
+            json.dump({'image_path': image_path, 'slogan': SAMPLE_SLOGAN, 'font_size': 2, 'outline_thickness': 5,
+                       'box_opacity': 50}, file)
+        for name, extra in (('eager', ['--eager']), ('lazy', [])):
+            runs = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                output = subprocess.run([sys.executable, script, config_path] + extra, check=True,
+                                        capture_output=True, text=True).stdout
+                run = json.loads(output.strip().splitlines()[-1])
+                run['wall_ms'] = (time.perf_counter() - start) * 1000
+                runs.append(run)
+            row = {'imports': name}
+            for column in ('window_ready_ms', 'first_frame_ms', 'wall_ms'):
+                row[column] = sorted(run[column] for run in runs)[len(runs) // 2]
+            results.append(row)
+    print_table(results, ('imports', 'window_ready_ms', 'first_frame_ms', 'wall_ms'))
+    return results
+
+
+BENCHMARKS = {
+    'outline': bench_outline,
+    'preview': bench_preview,
+    'scheduler': bench_scheduler,
+    'layers': bench_layers,
+    'layout': bench_layout,
+    'roi_memory': bench_roi_memory,
+    'copies': bench_copies,
+    'transparency': bench_transparency,
+    'decode': bench_decode,
+    'clipboard': bench_clipboard,
+    'server': bench_server,
+    'render_cache': bench_render_cache,
+    'animation': bench_animation,
+    'startup': bench_startup,
+    'text': bench_text,
+    'sizes': bench_sizes,
+    'history': bench_history,
+}
+
+
+# Pipeline suite: per-stage wall time and memory over a parameter sweep, saved as JSON so two runs
+# can be compared. Each parameter is swept on its own around SUITE_BASELINE.
+SUITE_SCHEMA = 1
+SUITE_BASELINE = {'megapixels': 4, 'lines': 3, 'font_scale': 2.0, 'outline': 3, 'box_opacity': 0.5, 'transparency': False}
+SUITE_SWEEPS = {
+    'megapixels': (1, 4, 12, 24, 50, 100),
+    'lines': (1, 3, 6, 12),
+    'font_scale': (1.0, 2.0, 4.0, 8.0),
+    'outline': (0, 1, 3, 5, 7),
+    'box_opacity': (0.0, 0.5, 1.0),
+    'transparency': (False, True),
+}
+SUITE_METRICS = ('wall_ms_median', 'wall_ms_best', 'peak_mb', 'pillow_mb', 'allocations')
+
+
+def megapixel_size(megapixels):
+    # 3:2 frame with the given pixel count
+    width = int(round(math.sqrt(megapixels * 1e6 * 1.5)))
+    return width, int(round(width / 1.5))
+
+
+def suite_cases(max_megapixels=100):
+    cases = []
+    for parameter, values in SUITE_SWEEPS.items():
+        for value in values:
+            case = dict(SUITE_BASELINE, **{parameter: value})
+            if case['megapixels'] <= max_megapixels and case not in cases:
+                cases.append(case)
+    return cases
+
+
+def case_id(stage, case):
+    return stage + "/" + "/".join(f"{key}={case[key]}" for key in SUITE_BASELINE)
+
+
+def suite_stages(image, spec):
+    # (stage name, function of the previous stage's output) in pipeline order
+    stages = [('caption', lambda _: add_slogan_to_image(image, spec))]
+    if spec.transparency:
+        stages.append(('transparency', lambda captioned: make_transparent(captioned)))
+    stages.append(('polaroid', lambda previous: create_polaroid(previous)))
+    stages.append(('resize', lambda polaroid: resize_image(polaroid, PREVIEW_SIZE, PREVIEW_SIZE)))
+    return stages
+
+
+def measure_stages(stages, frame_bytes, repeats):
+    rows = {}
+    # Timing pass, untraced; the first call of each stage warms the layout caches and is dropped
+    previous = None
+    for name, func in stages:
+        timings = []
+        for _ in range(repeats + 1):
+            start = time.perf_counter()
+            result = func(previous)
+            timings.append(time.perf_counter() - start)
+        timings = sorted(timings[1:])
+        rows[name] = {'wall_ms_median': timings[len(timings) // 2] * 1000, 'wall_ms_best': timings[0] * 1000}
+        previous = result
+    # Memory pass: traced NumPy/Python peak and Pillow block allocations per stage
+    allocations = StageAllocations(frame_bytes)
+    previous = None
+    for name, func in stages:
+        blocks_before = StageAllocations.pillow_blocks()
+        with allocations.stage(name):
+            previous = func(previous)
+        row = allocations.rows[-1]
+        rows[name].update({'peak_mb': row['numpy_frames'] * frame_bytes / 2 ** 20,
+                           'pillow_mb': row['pillow_frames'] * frame_bytes / 2 ** 20,
+                           'allocations': StageAllocations.pillow_blocks() - blocks_before})
+    return rows
+
+
+def run_suite(max_megapixels=100, repeats=3, log=print):
+    results = []
+    images = {}
+    for case in suite_cases(max_megapixels):
+        size = megapixel_size(case['megapixels'])
+        if size not in images:
+            images.clear()  # keep one source image alive at a time
+            images[size] = synthetic_image(*size)
+        slogan = "\n".join(f"LINE {index + 1} OF THE CAPTION" for index in range(case['lines']))
+        spec = CaptionSpec(slogan, font_scale=case['font_scale'], font_thickness=2, outline_thickness=case['outline'],
+                           box_opacity=case['box_opacity'], transparency=case['transparency'])
+        rows = measure_stages(suite_stages(images[size], spec), size[0] * size[1] * 4, repeats)
+        for stage, metrics in rows.items():
+            results.append({'id': case_id(stage, case), 'stage': stage, 'params': dict(case),
+                            **{metric: round(metrics[metric], 3) for metric in SUITE_METRICS}})
+            log(f"{results[-1]['id']:<80} {metrics['wall_ms_median']:>10.2f} ms")
+    return results
+
+
+def suite_environment():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+            'pillow': Image.__version__, 'machine': platform.machine(), 'system': platform.system(),
+            'cpu_count': os.cpu_count()}
+
+
+def write_suite(path, results, repeats):
+    document = {'schema': SUITE_SCHEMA, 'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'repeats': repeats, 'environment': suite_environment(),
+                'results': sorted(results, key=lambda row: row['id'])}
+    with open(path, 'w') as file:
+        json.dump(document, file, indent=1, sort_keys=True)
+        file.write("\n")
+
+
+def load_suite(path):
+    with open(path, 'r') as file:
+        document = json.load(file)
+    if document.get('schema') != SUITE_SCHEMA:
+        raise ValueError(f"{path}: unsupported suite schema {document.get('schema')}")
+    return document
+
+
+def compare_suites(baseline, current, threshold=0.10, metric='wall_ms_median', min_delta=1.0):
+    # A stage regresses when it is more than `threshold` (a fraction) worse AND worse by more than
+    # `min_delta` in absolute terms, so sub-millisecond stages don't fail on timer noise
+    if metric not in SUITE_METRICS:
+        raise ValueError(f"Unknown metric: {metric}")
+    base = {row['id']: row for row in baseline['results']}
+    rows = []
+    for row in current['results']:
+        if row['id'] not in base:
+            continue
+        old, new = base[row['id']][metric], row[metric]
+        ratio = new / old if old else (1.0 if not new else float('inf'))
+        regressed = ratio > 1 + threshold and new - old > min_delta
+        rows.append({'id': row['id'], 'baseline': float(old), 'current': float(new), 'change_pct': (ratio - 1) * 100,
+                     'status': 'REGRESSED' if regressed else ('improved' if ratio < 1 - threshold else 'ok')})
+    return rows
@@ -0,0 +1,209 @@
+"""Persistent render cache: encoded outputs keyed by source pixels + caption spec, LRU within a byte budget."""
+import hashlib
+import json
+import os
+import time
+import uuid
+
+import numpy as np
+
+from memepic_export import encode_image
+from memepic_render import frame_to_image, load_rgba, parse_color, render_frame, source_array
+
+CACHE_VERSION = 1  # bump when a render change makes old outputs stale
+DEFAULT_CACHE_BUDGET = 1024 * 1024 * 1024
+STALE_LOCK_SECONDS = 60
+
+# This process's estimate of each cache folder's size. Kept here rather than on RenderCache,
+# because batch workers get a fresh pickled copy of the cache with every task.
+FOLDER_BYTES = {}
+
+
+def pixel_digest(frame):
+    digest = hashlib.sha256(repr(frame.shape).encode())
+    digest.update(np.ascontiguousarray(frame).data)
+    return digest.hexdigest()
+
+
+def canonical_spec(spec):
+    # Equal renders must hash equally: 1 and 1.0, '255, 0,0' and '255,0,0'
+    data = {}
+    for field, value in spec.to_dict().items():
+        if field.endswith('_color'):
+            value = list(parse_color(value))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = float(value)
+        data[field] = value
+    return data
+
+
+def render_cache_key(digest, spec, options):
+    settings = json.dumps({'version': CACHE_VERSION, 'spec': canonical_spec(spec), 'format': options.format,
+                           'save': options.save_arguments()}, sort_keys=True)
+    return hashlib.sha256(f"{digest}:{settings}".encode()).hexdigest()
+
+
+class RenderCache:
+    # One file per entry under <folder>/<key[:2]>/, written to a temp name and renamed into place,
+    # so any number of processes can share the folder. The file mtime is the last-use time for LRU;
+    # eviction is done by whichever process holds <folder>/evict.lock. The source digests under
+    # <folder>/sources/ count towards the budget and are evicted the same way.
+
+    def __init__(self, folder, budget_bytes=DEFAULT_CACHE_BUDGET):
+        self.folder = folder
+        self.budget_bytes = budget_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def entry_path(self, key, extension):
+        return os.path.join(self.folder, key[:2], key + extension)
+
+    def get(self, key, extension):
+        path = self.entry_path(key, extension)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+            os.utime(path)
+        except OSError:
+            # Missing, or evicted by another process between open and utime
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key, extension, data):
+        path = self.entry_path(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, path)
+        self._added(len(data))
+
+    def _added(self, size):
+        folder = os.path.abspath(self.folder)
+        nbytes = FOLDER_BYTES.get(folder)
+        # A full scan only the first time this process writes to the folder
+        nbytes = self.scan()[0] if nbytes is None else nbytes + size
+        FOLDER_BYTES[folder] = nbytes
+        if nbytes > self.budget_bytes:
+            self.evict()
+
+    def source_digest(self, image_path):
+        # Pixel digests of source files by (path, size, mtime), so a cache hit needs no decode
+        path = self._source_index_path(image_path)
+        try:
+            with open(path, 'r') as file:
+                digest = file.read().strip() or None
+            os.utime(path)
+        except OSError:
+            return None
+        return digest
+
+    def remember_source(self, image_path, digest):
+        path = self._source_index_path(image_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w') as file:
+            file.write(digest)
+        os.replace(temp_path, path)
+        self._added(len(digest))
+
+    def _source_index_path(self, image_path):
+        stat = os.stat(image_path)
+        identity = f"{os.path.abspath(image_path)}:{stat.st_size}:{stat.st_mtime_ns}"
+        return os.path.join(self.folder, 'sources', hashlib.sha256(identity.encode()).hexdigest())
+
+    def scan(self):
+        total = 0
+        entries = []
+        for directory, _, names in os.walk(self.folder):
+            for name in names:
+                if name == 'evict.lock':
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                if name.endswith('.tmp') and time.time() - stat.st_mtime < STALE_LOCK_SECONDS:
+                    continue  # still being written; older ones were abandoned and are fair game
+                total += stat.st_size
+                entries.append((stat.st_mtime, stat.st_size, path))
+        return total, entries
+
+    def evict(self):
+        lock_path = os.path.join(self.folder, 'evict.lock')
+        try:
+            if time.time() - os.path.getmtime(lock_path) > STALE_LOCK_SECONDS:
+                os.remove(lock_path)  # left behind by a process that died mid-eviction
+        except OSError:
+            pass
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            return  # another process is already evicting
+        try:
+            total, entries = self.scan()
+            # Down to 90% of the budget so the next few writes don't each trigger a scan
+            target = self.budget_bytes * 0.9
+            for _, size, path in sorted(entries):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self.evictions += 1
+            FOLDER_BYTES[os.path.abspath(self.folder)] = total
+        finally:
+            os.remove(lock_path)
+
+    def clear(self):
+        _, entries = self.scan()
+        for _, _, path in entries:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        FOLDER_BYTES[os.path.abspath(self.folder)] = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        nbytes, entries = self.scan()
+        return {'cache_entries': len(entries), 'cache_mb': nbytes / 2 ** 20, 'cache_budget_mb': self.budget_bytes / 2 ** 20,
+                'cache_hits': self.hits, 'cache_misses': self.misses, 'cache_evictions': self.evictions,
+                'cache_hit_rate': self.hits / total if total else 0.0}
+
+
+def render_file_cached(cache, image_path, spec, options):
+    # Returns (encoded bytes, cache hit). A file seen before is looked up without decoding it.
+    digest = cache.source_digest(image_path)
+    frame = None
+    if digest is None:
+        frame = source_array(load_rgba(image_path))
+        digest = pixel_digest(frame)
+        cache.remember_source(image_path, digest)
+    key = render_cache_key(digest, spec, options)
+    data = cache.get(key, options.extension)
+    if data is not None:
+        return data, True
+    if frame is None:
+        frame = source_array(load_rgba(image_path))
+    data = encode_image(frame_to_image(render_frame(frame, spec)), options)
+    cache.put(key, options.extension, data)
+    return data, False
+
+
+def render_frame_cached(cache, digest, frame, spec, options):
+    # Same, for a source that is already decoded and hashed
+    key = render_cache_key(digest, spec, options)
+    data = cache.get(key, options.extension)
+    if data is not None:
+        return data, True
+    data = encode_image(frame_to_image(render_frame(frame, spec)), options)
+    cache.put(key, options.extension, data)
+    return data, False
@@ -0,0 +1,398 @@
+"""Headless command-line entry points for MEMEPIC (no Tk display required)."""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from memepic_animation import animated_extension, is_animated, render_animation
+from memepic_cache import RenderCache, render_file_cached
+from memepic_export import (EXPORT_FORMATS, ExportOptions, parse_compress_level, parse_quality, parse_sizes, sized_paths,
+                            write_atomic, write_bytes_atomic, write_sizes)
+from memepic_render import CaptionSpec, OUTLINE_ENGINES, OUTLINE_KERNELS, load_rgba, render_caption
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.webp')
+
+
+def collect_images(paths):
+    images = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(os.listdir(path)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    images.append(os.path.join(path, name))
+        elif os.path.isfile(path):
+            images.append(path)
+        else:
+            print(f"Invalid image path: {path}")
+    return images
+
+
+def load_spec(args):
+    if args.config:
+        with open(args.config, 'r') as file:
+            spec = CaptionSpec.from_config(json.load(file))
+    elif args.spec:
+        with open(args.spec, 'r') as file:
+            spec = CaptionSpec.from_dict(json.load(file))
+    else:
+        spec = CaptionSpec()
+    overrides = {
+        'slogan': args.slogan,
+        'font_color': args.font_color,
+        'font_thickness': args.font_thickness,
+        'font_scale': args.font_scale,
+        'outline_color': args.outline_color,
+        'outline_thickness': args.outline_thickness,
+        'box_color': args.box_color,
+        'box_opacity': args.box_opacity,
+        'text_position': args.text_position,
+        'box_width': args.box_width,
+        'outline_engine': args.outline_engine,
+        'outline_kernel': args.outline_kernel,
+        'font': args.font,
+    }
+    data = spec.to_dict()
+    data.update({key: value for key, value in overrides.items() if value is not None})
+    if args.transparency:
+        data['transparency'] = True
+    return CaptionSpec.from_dict(data)
+
+
+def load_export_options(args):
+    return ExportOptions(args.format, args.compress_level, args.quality, getattr(args, 'sizes', None))
+
+
+def output_path_for(image_path, output_folder, extension=".png", keep_extension=False):
+    # meme_<stem>.png, or meme_<stem>_<source extension>.png so photo.jpg and photo.png stay apart
+    stem, source_extension = os.path.splitext(os.path.basename(image_path))
+    if keep_extension and source_extension:
+        stem = f"{stem}_{source_extension[1:]}"
+    return os.path.join(output_folder, f"meme_{stem}{extension}")
+
+
+def output_paths_for(images, output_folder, extension=".png"):
+    # One output path per input, unique within the batch (compared case-insensitively, as on
+    # Windows and macOS): inputs whose stems clash keep their extension in the name, and inputs
+    # that still clash (same name in different folders) get a counter
+    stems = {}
+    for image_path in images:
+        stem = os.path.splitext(os.path.basename(image_path))[0].lower()
+        stems[stem] = stems.get(stem, 0) + 1
+    paths = {}
+    taken = set()
+    for image_path in images:
+        stem = os.path.splitext(os.path.basename(image_path))[0].lower()
+        output_path = output_path_for(image_path, output_folder, extension, keep_extension=stems[stem] > 1)
+        root = os.path.splitext(output_path)[0]
+        counter = 1
+        while os.path.normcase(output_path).lower() in taken:
+            output_path = f"{root}_{counter}{extension}"
+            counter += 1
+        taken.add(os.path.normcase(output_path).lower())
+        paths[image_path] = output_path
+    if len(taken) != len(images):
+        raise ValueError("Output names collide; some renders would overwrite others")
+    return paths
+
+
+def load_render_cache(args):
+    return RenderCache(args.cache_dir, args.cache_mb * 1024 * 1024) if args.cache_dir else None
+
+
+def render_job(image_path, output_path, spec_dict, options, cache=None, frame_workers=1):
+    start = time.perf_counter()
+    spec = CaptionSpec.from_dict(spec_dict)
+    if is_animated(image_path):
+        # Animations keep their container (GIF/APNG/WebP) and skip the render cache
+        output_path = os.path.splitext(output_path)[0] + animated_extension(image_path)
+        render_animation(image_path, output_path, spec, options, frame_workers)
+        return output_path, time.perf_counter() - start, False
+    if options.multi_size:
+        # One render, then every size from the pyramid; the render cache holds single outputs only
+        rendered = render_caption(load_rgba(image_path), spec)
+        write_sizes(rendered, sized_paths(output_path, options), options)
+        return output_path, time.perf_counter() - start, False
+    if cache is not None:
+        data, hit = render_file_cached(cache, image_path, spec, options)
+        write_bytes_atomic(data, output_path)
+        return output_path, time.perf_counter() - start, hit
+    rendered = render_caption(load_rgba(image_path), spec)
+    write_atomic(rendered, output_path, options)
+    return output_path, time.perf_counter() - start, False
+
+
+def run_batch(args):
+    images = collect_images(args.inputs)
+    if not images:
+        print("No images to render")
+        return 1
+    os.makedirs(args.output_folder, exist_ok=True)
+    spec_dict = load_spec(args).to_dict()
+    options = load_export_options(args)
+    workers = args.workers or os.cpu_count() or 1
+    cache = load_render_cache(args)
+    if cache is not None and options.multi_size:
+        print("Ignoring --cache-dir: the render cache is not used with --sizes")
+        cache = None
+
+    output_paths = output_paths_for(images, args.output_folder, options.extension)
+    failures = 0
+    hits = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(render_job, path, output_paths[path], spec_dict, options, cache, args.frame_workers): path for path in images}
+        for future in as_completed(futures):
+            try:
+                output_path, seconds, hit = future.result()
+                hits += hit
+                if args.verbose:
+                    print(f"Image saved to {output_path} ({seconds * 1000:.0f} ms{', cached' if hit else ''})")
+            except Exception as e:
+                failures += 1
+                print(f"Error rendering {futures[future]}: {e}")
+    elapsed = time.perf_counter() - start
+
+    rendered = len(images) - failures
+    rate = rendered / elapsed if elapsed > 0 else 0.0
+    print(f"Rendered {rendered}/{len(images)} images in {elapsed:.2f}s ({rate:.2f} images/sec, {workers} workers)")
+    if cache is not None:
+        print(f"Render cache: {hits}/{len(images)} hits ({hits / len(images):.0%})")
+    return 1 if failures else 0
+
+
+def run_template(args):
+    from memepic_template import run_template
+    workers = args.workers or os.cpu_count() or 1
+    return run_template(args.template, load_spec(args), args.output_folder, load_export_options(args), workers,
+                        args.manifest, args.shared_mb * 1024 * 1024, args.verbose, load_render_cache(args))
+
+
+def run_cache(args):
+    cache = RenderCache(args.cache_dir, args.cache_mb * 1024 * 1024)
+    if args.clear:
+        cache.clear()
+    elif args.evict:
+        cache.evict()
+    stats = cache.stats()
+    print(f"{stats['cache_entries']} entries, {stats['cache_mb']:.1f} / {stats['cache_budget_mb']:.0f} MB in {args.cache_dir}")
+    return 0
+
+
+def run_serve(args):
+    from memepic_server import run_server
+    return run_server(load_spec(args), load_export_options(args), args.host, args.port, args.workers or None,
+                      args.cache_mb * 1024 * 1024)
+
+
+def run_watch(args):
+    from memepic_watch import load_preset, run_watch
+    spec, options, preset_folder = load_preset(args.preset)
+    output_folder = args.output_folder or preset_folder
+    if not output_folder:
+        print(f"No output folder: pass -o or set output_folder in {args.preset}")
+        return 1
+    workers = args.workers or os.cpu_count() or 1
+    return run_watch(args.input_folder, spec, options, output_folder, workers, args.index, args.interval, args.settle,
+                     load_render_cache(args), args.once, args.frame_workers, args.verbose)
+
+
+def run_bench(args):
+    from memepic_bench import BENCHMARKS
+    for name in args.benchmarks or list(BENCHMARKS):
+        print(f"== {name} ==")
+        BENCHMARKS[name](repeats=args.repeats)
+    return 0
+
+
+def run_trace(args):
+    # Replays the app's render paths headlessly with tracing on: preview drags (update_sample_text),
+    # full renders (update_image_with_settings), SAVE and COPY
+    import tempfile
+    from memepic_clipboard import ClipboardPipeline, MemoryClipboardBackend
+    from memepic_export import export_image
+    from memepic_layers import LayeredRenderer
+    from memepic_render import frame_to_image, render_frame, resize_image
+    from memepic_source import FileImageSource
+    from memepic_trace import TRACER, span
+    from memepic_transparency import KeyMaskCache
+
+    TRACER.enable()
+    spec = load_spec(args)
+    options = load_export_options(args)
+    source = FileImageSource(args.image)
+    renderer = LayeredRenderer()
+    key_cache = KeyMaskCache()
+    clipboard = ClipboardPipeline(MemoryClipboardBackend())
+    proxy = source.preview()
+    for index in range(args.previews):
+        dragged = CaptionSpec.from_dict(dict(spec.to_dict(), text_position=index * 7 % 101))
+        renderer.render_preview(proxy, dragged, source.size)
+    with tempfile.TemporaryDirectory() as folder:
+        for index in range(args.repeats):
+            with span('full_render'):
+                frame = render_frame(source.array(), spec, key_cache=key_cache)
+            resize_image(frame_to_image(frame), 300, 300)
+            with span('save'):
+                export_image(frame_to_image(render_frame(source.array(), spec, key_cache=key_cache)), folder, options)
+            with span('copy'):
+                clipboard.copy(index, lambda: frame_to_image(render_frame(source.array(), spec, key_cache=key_cache)),
+                               spec.transparency)
+    print(TRACER.summary())
+    if args.output:
+        print(f"Chrome trace written to {TRACER.write_chrome_trace(args.output)}")
+    return 0
+
+
+def run_suite(args):
+    from memepic_bench import run_suite, write_suite
+    results = run_suite(args.max_mp, args.repeats)
+    write_suite(args.output, results, args.repeats)
+    print(f"Wrote {len(results)} stage results to {args.output}")
+    return 0
+
+
+def run_compare(args):
+    from memepic_bench import compare_suites, load_suite
+    rows = compare_suites(load_suite(args.baseline), load_suite(args.current), args.threshold / 100.0, args.metric,
+                          args.min_delta)
+    shown = rows if args.all else [row for row in rows if row['status'] != 'ok']
+    if shown:
+        width = max(len(row['id']) for row in shown)
+        print(f"{'stage':<{width}}  {'baseline':>10}  {'current':>10}  {'change':>8}  status")
+        for row in shown:
+            print(f"{row['id']:<{width}}  {row['baseline']:>10.2f}  {row['current']:>10.2f}  {row['change_pct']:>7.1f}%  {row['status']}")
+    regressions = sum(row['status'] == 'REGRESSED' for row in rows)
+    print(f"{len(rows)} stages compared on {args.metric}: {regressions} regressed past {args.threshold:g}%")
+    return 1 if regressions else 0
+
+
+def add_spec_arguments(parser):
+    parser.add_argument('--config', help="config.json written by the MEMEPIC app to take caption settings from")
+    parser.add_argument('--spec', help="JSON file with CaptionSpec fields")
+    parser.add_argument('--slogan')
+    parser.add_argument('--font-color')
+    parser.add_argument('--font-thickness', type=int)
+    parser.add_argument('--font-scale', type=float)
+    parser.add_argument('--outline-color')
+    parser.add_argument('--outline-thickness', type=int)
+    parser.add_argument('--box-color')
+    parser.add_argument('--box-opacity', type=float, help="0.0 - 1.0")
+    parser.add_argument('--text-position', type=int, help="0 - 100")
+    parser.add_argument('--box-width', type=int, help="0 - 100")
+    parser.add_argument('--transparency', action='store_true')
+    parser.add_argument('--outline-engine', choices=OUTLINE_ENGINES)
+    parser.add_argument('--outline-kernel', choices=OUTLINE_KERNELS, help="Dilation kernel for --outline-engine dilate")
+    parser.add_argument('--font', help="TrueType/OpenType font file (e.g. impact.ttf) instead of the built-in Hershey font")
+
+
+def add_cache_arguments(parser):
+    parser.add_argument('--cache-dir', help="Reuse encoded renders from this folder across runs")
+    parser.add_argument('--cache-mb', type=int, default=1024, help="Render cache size limit")
+
+
+def add_export_arguments(parser):
+    parser.add_argument('--format', choices=sorted(EXPORT_FORMATS), default='png')
+    parser.add_argument('--compress-level', type=parse_compress_level, default=6, help="PNG zlib level 0 - 9")
+    parser.add_argument('--quality', type=parse_quality, default=90, help="JPEG/WebP quality 1 - 100")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="memepic", description="Headless MEMEPIC tools")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    batch = subparsers.add_parser('batch', help="Caption many images in parallel")
+    batch.add_argument('inputs', nargs='+', help="Image files or folders")
+    batch.add_argument('-o', '--output-folder', required=True)
+    batch.add_argument('-j', '--workers', type=int, default=0, help="Worker processes (default: all cores)")
+    batch.add_argument('--frame-workers', type=int, default=1, help="Threads compositing the frames of one animation")
+    batch.add_argument('-v', '--verbose', action='store_true')
+    add_spec_arguments(batch)
+    add_export_arguments(batch)
+    batch.add_argument('--sizes', type=parse_sizes, help="Also write smaller copies, e.g. full,1080,512,300 (longest side in pixels)")
+    add_cache_arguments(batch)
+    batch.set_defaults(func=run_batch)
+
+    template = subparsers.add_parser('template', help="Render caption variants listed in a CSV/JSONL file")
+    template.add_argument('template', help="CSV or JSONL rows: image, optional output, and CaptionSpec fields to override")
+    template.add_argument('-o', '--output-folder', required=True)
+    template.add_argument('-j', '--workers', type=int, default=0, help="Worker processes (default: all cores)")
+    template.add_argument('-m', '--manifest', help="Per-row timing manifest (default: <output>/manifest.jsonl)")
+    template.add_argument('--shared-mb', type=int, default=1024, help="Decoded images kept in shared memory at once")
+    template.add_argument('-v', '--verbose', action='store_true')
+    add_spec_arguments(template)
+    add_export_arguments(template)
+    add_cache_arguments(template)
+    template.set_defaults(func=run_template)
+
+    serve = subparsers.add_parser('serve', help="Serve captioned renders over HTTP on localhost")
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument('-j', '--workers', type=int, default=0, help="Render processes (default: all cores)")
+    serve.add_argument('--cache-mb', type=int, default=128, help="Memory for cached responses")
+    add_spec_arguments(serve)
+    add_export_arguments(serve)
+    serve.set_defaults(func=run_serve)
+
+    cache = subparsers.add_parser('cache', help="Show, trim or clear a render cache folder")
+    cache.add_argument('cache_dir')
+    cache.add_argument('--cache-mb', type=int, default=1024, help="Render cache size limit")
+    cache.add_argument('--evict', action='store_true', help="Trim the cache to --cache-mb")
+    cache.add_argument('--clear', action='store_true', help="Remove every cached render")
+    cache.set_defaults(func=run_cache)
+
+    trace = subparsers.add_parser('trace', help="Time each render stage of the app's paths on one image")
+    trace.add_argument('image')
+    trace.add_argument('-o', '--output', help="Write a Chrome trace (chrome://tracing, Perfetto) to this file")
+    trace.add_argument('-p', '--previews', type=int, default=50, help="Preview renders, as from dragging a slider")
+    trace.add_argument('-r', '--repeats', type=int, default=5, help="Full renders, saves and copies")
+    add_spec_arguments(trace)
+    add_export_arguments(trace)
+    trace.set_defaults(func=run_trace)
+
+    suite = subparsers.add_parser('suite', help="Sweep the render pipeline and save per-stage results as JSON")
+    suite.add_argument('-o', '--output', required=True, help="Results file")
+    suite.add_argument('--max-mp', type=float, default=100, help="Largest image size to sweep, in megapixels")
+    suite.add_argument('-r', '--repeats', type=int, default=3)
+    suite.set_defaults(func=run_suite)
+
+    compare = subparsers.add_parser('compare', help="Compare two suite results; fails on a regression")
+    compare.add_argument('baseline')
+    compare.add_argument('current')
+    compare.add_argument('-t', '--threshold', type=float, default=10.0, help="Allowed slowdown per stage, in percent")
+    compare.add_argument('--metric', default='wall_ms_median',
+                         choices=('wall_ms_median', 'wall_ms_best', 'peak_mb', 'pillow_mb', 'allocations'))
+    compare.add_argument('--min-delta', type=float, default=1.0, help="Ignore changes smaller than this (ms or MB)")
+    compare.add_argument('-a', '--all', action='store_true', help="List every stage, not just changes")
+    compare.set_defaults(func=run_compare)
+
+    watch = subparsers.add_parser('watch', help="Caption new images dropped into a folder with a saved preset")
+    watch.add_argument('input_folder')
+    watch.add_argument('-p', '--preset', default='config.json', help="config.json from the MEMEPIC app, or a file with the same fields")
+    watch.add_argument('-o', '--output-folder', help="Default: the preset's output_folder")
+    watch.add_argument('-j', '--workers', type=int, default=0, help="Worker processes (default: all cores)")
+    watch.add_argument('--frame-workers', type=int, default=1, help="Threads compositing the frames of one animation")
+    watch.add_argument('--index', help="Processed-file index (default: <output>/.memepic-watch.jsonl)")
+    watch.add_argument('--interval', type=float, default=1.0, help="Seconds between folder scans")
+    watch.add_argument('--settle', type=float, default=2.0, help="Seconds a file must go unmodified before it is captioned")
+    watch.add_argument('--once', action='store_true', help="Caption what is there now and exit")
+    watch.add_argument('-v', '--verbose', action='store_true')
+    add_cache_arguments(watch)
+    watch.set_defaults(func=run_watch)
+
+    bench = subparsers.add_parser('bench', help="Run render micro-benchmarks")
+    bench.add_argument('benchmarks', nargs='*', help="Benchmarks to run (default: all)")
+    bench.add_argument('-r', '--repeats', type=int, default=5)
+    bench.set_defaults(func=run_bench)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+"""Clipboard backends that take an already-encoded PNG from memory."""
+import io
+import os
+import shutil
+import struct
+import subprocess
+import sys
+
+from memepic_export import flatten_onto_white
+from memepic_trace import span
+
+
+def encode_png(image, compress_level=1):
+    # Straight into memory; clipboard payloads favour encode speed over size
+    buffer = io.BytesIO()
+    with span('encode', format='png'):
+        image.save(buffer, format="PNG", compress_level=compress_level)
+    return buffer.getvalue()
+
+
+def clipboard_image(image, transparency):
+    if transparency:
+        # If transparency is selected, keep the image as is (with transparency)
+        return image if image.mode == 'RGBA' else image.convert('RGBA')
+    # If transparency is not selected, ensure opaque background
+    return flatten_onto_white(image)
+
+
+class ClipboardBackend:
+    name = 'base'
+
+    @classmethod
+    def available(cls):
+        return False
+
+    def copy_png(self, png_bytes, image=None):
+        raise NotImplementedError
+
+
+class MemoryClipboardBackend(ClipboardBackend):
+    # In-process clipboard for headless use, tests and timing
+    name = 'memory'
+
+    def __init__(self):
+        self.png_bytes = None
+        self.copies = 0
+
+    @classmethod
+    def available(cls):
+        return True
+
+    def copy_png(self, png_bytes, image=None):
+        self.png_bytes = png_bytes
+        self.copies += 1
+
+
+class Win32ClipboardBackend(ClipboardBackend):
+    name = 'win32'
+
+    @classmethod
+    def available(cls):
+        if sys.platform != 'win32':
+            return False
+        try:
+            import win32clipboard  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def copy_png(self, png_bytes, image=None):
+        import win32clipboard as clp
+        clp.OpenClipboard()
+        try:
+            clp.EmptyClipboard()
+            clp.SetClipboardData(clp.RegisterClipboardFormat('PNG'), png_bytes)
+            if image is not None:
+                # Plain DIB as well, for apps that don't read the PNG format
+                clp.SetClipboardData(clp.CF_DIB, dib_bytes(image))
+        finally:
+            clp.CloseClipboard()
+
+
+def dib_bytes(image):
+    buffer = io.BytesIO()
+    image.convert('RGB').save(buffer, format="BMP")
+    bmp = buffer.getvalue()
+    header_size = struct.calcsize('<2sIHHI')  # BITMAPFILEHEADER
+    return bmp[header_size:]
+
+
+class CommandClipboardBackend(ClipboardBackend):
+    # Pipes the PNG into a clipboard tool's stdin
+    command = ()
+
+    @classmethod
+    def available(cls):
+        return bool(cls.command) and shutil.which(cls.command[0]) is not None
+
+    def copy_png(self, png_bytes, image=None):
+        subprocess.run(self.command, input=png_bytes, check=True, timeout=10)
+
+
+class WaylandClipboardBackend(CommandClipboardBackend):
+    name = 'wayland'
+    command = ('wl-copy', '--type', 'image/png')
+
+    @classmethod
+    def available(cls):
+        return bool(os.environ.get('WAYLAND_DISPLAY')) and super().available()
+
+
+class X11ClipboardBackend(CommandClipboardBackend):
+    name = 'x11'
+    command = ('xclip', '-selection', 'clipboard', '-target', 'image/png', '-in')
+
+    @classmethod
+    def available(cls):
+        return bool(os.environ.get('DISPLAY')) and super().available()
+
+
+CLIPBOARD_BACKENDS = {backend.name: backend for backend in (
+    Win32ClipboardBackend, WaylandClipboardBackend, X11ClipboardBackend, MemoryClipboardBackend)}
+
+
+def get_clipboard_backend(name=None):
+    if name:
+        if name not in CLIPBOARD_BACKENDS:
+            raise ValueError(f"Unknown clipboard backend: {name}")
+        return CLIPBOARD_BACKENDS[name]()
+    for backend in CLIPBOARD_BACKENDS.values():
+        if backend.available():
+            return backend()
+    return MemoryClipboardBackend()
+
+
+class ClipboardPipeline:
+    # Keeps the encoded PNG of the last copy, keyed by the render it came from, so copying the
+    # same render again is just a hand-off to the backend
+
+    def __init__(self, backend=None):
+        self.backend = backend or get_clipboard_backend()
+        self.hits = 0
+        self.misses = 0
+        self._key = None
+        self._image = None
+        self._png = None
+
+    def copy(self, key, render, transparency):
+        # `render` is only called when `key` differs from the last copy's
+        if self._png is None or key != self._key:
+            self.misses += 1
+            self._image = clipboard_image(render(), transparency)
+            self._png = encode_png(self._image)
+            self._key = key
+        else:
+            self.hits += 1
+        with span('clipboard', backend=self.backend.name):
+            self.backend.copy_png(self._png, self._image)
+        return len(self._png)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'clipboard_backend': self.backend.name, 'clipboard_hit_rate': self.hits / total if total else 0.0}
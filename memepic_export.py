@@ -0,0 +1,298 @@
+"""Background export: encode in a worker pool and write atomically under a collision-free name."""
+import io
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from PIL import Image
+
+from memepic_trace import span
+
+# format name -> (file extension, Pillow format)
+EXPORT_FORMATS = {
+    'png': ('.png', 'PNG'),
+    'jpeg': ('.jpg', 'JPEG'),
+    'webp': ('.webp', 'WEBP'),
+}
+
+
+def parse_compress_level(level):
+    level = int(level)
+    if not 0 <= level <= 9:
+        raise ValueError(f"PNG compression level must be 0 - 9: {level}")
+    return level
+
+
+def parse_quality(quality):
+    quality = int(quality)
+    if not 1 <= quality <= 100:
+        raise ValueError(f"Quality must be 1 - 100: {quality}")
+    return quality
+
+
+def parse_sizes(sizes):
+    # "full,1080,512" or ['full', 1080, 512] -> (None, 1080, 512): longest side in pixels, None for
+    # full resolution, largest first and without duplicates
+    if sizes is None:
+        return (None,)
+    if isinstance(sizes, str):
+        sizes = [size.strip() for size in sizes.split(',') if size.strip()]
+    parsed = set()
+    for size in sizes:
+        if size is None or str(size).lower() == 'full':
+            parsed.add(None)
+            continue
+        try:
+            size = int(size)
+        except ValueError:
+            raise ValueError(f"Unknown export size: {size}")
+        if size < 1:
+            raise ValueError(f"Export size must be positive: {size}")
+        parsed.add(size)
+    if not parsed:
+        raise ValueError("No export sizes given")
+    return tuple(sorted(parsed, key=lambda size: float('inf') if size is None else size, reverse=True))
+
+
+def size_suffix(size):
+    return "" if size is None else f"_{size}"
+
+
+class ExportOptions:
+    def __init__(self, format='png', compress_level=6, quality=90, sizes=None):
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {format}")
+        self.format = format
+        self.compress_level = parse_compress_level(compress_level)
+        self.quality = parse_quality(quality)
+        self.sizes = parse_sizes(sizes)
+
+    @property
+    def multi_size(self):
+        return self.sizes != (None,)
+
+    @property
+    def extension(self):
+        return EXPORT_FORMATS[self.format][0]
+
+    def save_arguments(self):
+        if self.format == 'png':
+            return {'compress_level': self.compress_level}
+        return {'quality': self.quality}
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(config.get('export_format', 'png'), config.get('png_compress_level', 6), config.get('export_quality', 90),
+                   config.get('export_sizes'))
+
+    def config_sizes(self):
+        return ['full' if size is None else size for size in self.sizes]
+
+
+def flatten_onto_white(image):
+    # JPEG has no alpha channel: composite onto an opaque white background
+    if image.mode not in ('RGBA', 'LA'):
+        return image.convert('RGB')
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.split()[-1])
+    return background
+
+
+def reserve_output_path(output_folder, prefix="meme", extension=".png", when=None):
+    # Claim meme_<timestamp>.png, or meme_<timestamp>_<n>.png if that name is taken, by creating it
+    # with O_EXCL, so rapid saves (from any thread or process) never overwrite each other
+    return reserve_output_paths(output_folder, prefix, extension, ("",), when)[0]
+
+
+def reserve_output_paths(output_folder, prefix="meme", extension=".png", suffixes=("",), when=None):
+    # The same, for a set of names that share one stem (meme_<timestamp>_1080.png, ...): all of
+    # them are claimed, or none and the next counter is tried
+    timestamp = (when or datetime.now()).strftime("%Y%m%d_%H%M%S")
+    counter = 0
+    while True:
+        stem = f"{prefix}_{timestamp}" + (f"_{counter}" if counter else "")
+        claimed = []
+        try:
+            for suffix in suffixes:
+                file_path = os.path.normpath(os.path.join(output_folder, f"{stem}{suffix}{extension}"))
+                os.close(os.open(file_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                claimed.append(file_path)
+            return claimed
+        except FileExistsError:
+            for file_path in claimed:
+                os.remove(file_path)
+            counter += 1
+
+
+def encode_image(image, options):
+    pillow_format = EXPORT_FORMATS[options.format][1]
+    if pillow_format == 'JPEG':
+        image = flatten_onto_white(image)
+    buffer = io.BytesIO()
+    with span('encode', format=options.format):
+        image.save(buffer, pillow_format, **options.save_arguments())
+    return buffer.getvalue()
+
+
+def write_bytes_atomic(data, file_path):
+    temp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(temp_path, 'wb') as file:
+            file.write(data)
+        os.replace(temp_path, file_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return len(data)
+
+
+def write_atomic(image, file_path, options):
+    # Encode to a temporary file next to the target, then rename over it, so a reader never sees a
+    # half-written image
+    temp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+    pillow_format = EXPORT_FORMATS[options.format][1]
+    if pillow_format == 'JPEG':
+        image = flatten_onto_white(image)
+    try:
+        with span('encode', format=options.format):
+            image.save(temp_path, pillow_format, **options.save_arguments())
+        os.replace(temp_path, file_path)
+    except Exception:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return os.path.getsize(file_path)
+
+
+def size_pyramid(image, sizes):
+    # (size, image) for each requested size, largest first. Each level is resized from the one above
+    # it rather than from full resolution, so every LANCZOS pass reads fewer pixels. Images already
+    # within a size are not upscaled.
+    level = image
+    for size in sizes:
+        if size is not None and max(level.size) > size:
+            ratio = size / max(level.size)
+            with span('resize'):
+                level = level.resize((max(1, round(level.width * ratio)), max(1, round(level.height * ratio))), Image.LANCZOS)
+        yield size, level
+
+
+def write_sizes(image, file_paths, options):
+    # One output per size in options.sizes, to the matching path. Each level is encoded on its own
+    # thread as soon as it is resized, while the next level is being made.
+    with ThreadPoolExecutor(max_workers=len(file_paths), thread_name_prefix="memepic-sizes") as pool:
+        futures = [pool.submit(write_atomic, level, file_path, options)
+                   for (_, level), file_path in zip(size_pyramid(image, options.sizes), file_paths)]
+        return sum(future.result() for future in futures)
+
+
+def sized_paths(output_path, options):
+    stem, extension = os.path.splitext(output_path)
+    return [f"{stem}{size_suffix(size)}{extension}" for size in options.sizes]
+
+
+def export_image(image, output_folder, options, prefix="meme"):
+    os.makedirs(output_folder, exist_ok=True)
+    file_paths = reserve_output_paths(output_folder, prefix, options.extension, [size_suffix(size) for size in options.sizes])
+    try:
+        if options.multi_size:
+            size = write_sizes(image, file_paths, options)
+        else:
+            size = write_atomic(image, file_paths[0], options)
+    except Exception:
+        for file_path in file_paths:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        raise
+    return file_paths[0], size
+
+
+class ExportResult:
+    def __init__(self, file_path, nbytes, seconds, error=None):
+        self.file_path = file_path
+        self.nbytes = nbytes
+        self.seconds = seconds
+        self.error = error
+
+
+class ExportQueue:
+    # Exports run on a small thread pool (Pillow releases the GIL while encoding). Finished
+    # exports are collected for poll(), which the app calls from the Tk main loop.
+
+    def __init__(self, max_workers=2):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="memepic-export")
+        self._lock = threading.Lock()
+        self._finished = deque()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.bytes_written = 0
+        self.busy_seconds = 0.0
+        self.started_at = None
+
+    def submit(self, image, output_folder, options, prefix="meme", writer=export_image):
+        # `image` may be a callable producing the image, so the full render also leaves the UI thread.
+        # `writer(image, output_folder, options, prefix)` returns (file path, bytes written).
+        with self._lock:
+            self.submitted += 1
+            if self.started_at is None:
+                self.started_at = time.perf_counter()
+        return self._pool.submit(self._export, image, output_folder, options, prefix, writer)
+
+    def _export(self, image, output_folder, options, prefix, writer):
+        start = time.perf_counter()
+        try:
+            with span('save'):
+                if callable(image):
+                    image = image()
+                file_path, nbytes = writer(image, output_folder, options, prefix)
+            result = ExportResult(file_path, nbytes, time.perf_counter() - start)
+        except Exception as e:
+            result = ExportResult(None, 0, time.perf_counter() - start, e)
+        with self._lock:
+            if result.error is None:
+                self.completed += 1
+                self.bytes_written += result.nbytes
+            else:
+                self.failed += 1
+            self.busy_seconds += result.seconds
+            self._finished.append(result)
+        return result
+
+    def poll(self):
+        with self._lock:
+            finished = list(self._finished)
+            self._finished.clear()
+        return finished
+
+    def pending(self):
+        with self._lock:
+            return self.submitted - self.completed - self.failed
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.perf_counter() - self.started_at if self.started_at is not None else 0.0
+            done = self.completed + self.failed
+            return {
+                'exports_submitted': self.submitted,
+                'exports_completed': self.completed,
+                'exports_failed': self.failed,
+                'exports_pending': self.submitted - done,
+                'export_images_per_sec': self.completed / elapsed if elapsed > 0 else 0.0,
+                'export_mb_per_sec': self.bytes_written / 2 ** 20 / elapsed if elapsed > 0 else 0.0,
+                'export_avg_ms': self.busy_seconds / done * 1000 if done else 0.0,
+            }
+
+    def status_line(self):
+        stats = self.stats()
+        done = stats['exports_completed'] + stats['exports_failed']
+        return (f"Exported {done}/{stats['exports_submitted']} "
+                f"({stats['export_images_per_sec']:.2f} img/s, {stats['export_mb_per_sec']:.1f} MB/s)")
+
+    def shutdown(self, wait=True):
+        self._pool.shutdown(wait=wait)
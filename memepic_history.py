@@ -0,0 +1,170 @@
+"""Non-destructive edits: an operation list over the decoded source, replayed from cached checkpoints."""
+import threading
+from collections import OrderedDict
+
+from memepic_render import create_polaroid, make_preview_proxy
+from memepic_source import PROXY_SIZE, ImageSource
+
+DEFAULT_CHECKPOINT_EVERY = 4
+DEFAULT_HISTORY_BUDGET = 256 * 1024 * 1024
+
+
+def polaroid(image, scale=1.0, border_size=50):
+    return create_polaroid(image, max(1, int(round(border_size * scale))))
+
+
+def polaroid_size(size, border_size=50):
+    return size[0] + 2 * border_size, size[1] + 4 * border_size
+
+
+# name -> (apply(image, scale, **params), size after it(size, **params)). `scale` is the image's size
+# relative to full resolution, so pixel parameters shrink with the preview proxy.
+OPERATIONS = {
+    'polaroid': (polaroid, polaroid_size),
+}
+
+
+def operation(name, **params):
+    if name not in OPERATIONS:
+        raise ValueError(f"Unknown edit operation: {name}")
+    return name, tuple(sorted(params.items()))
+
+
+def apply_operation(image, op, scale=1.0):
+    name, params = op
+    return OPERATIONS[name][0](image, scale, **dict(params))
+
+
+def operation_size(size, op):
+    name, params = op
+    return OPERATIONS[name][1](size, **dict(params))
+
+
+def image_nbytes(image):
+    return image.width * image.height * len(image.getbands())
+
+
+class EditHistory:
+    # Edits to one source as (name, params) operations, with a position for undo/redo. The rendered
+    # result of step n is rebuilt from the nearest checkpoint at or before n; checkpoints are taken
+    # every `checkpoint_every` steps during a replay and kept LRU within `budget_bytes`. Step 0 is
+    # the source itself and costs nothing here.
+
+    def __init__(self, source, checkpoint_every=DEFAULT_CHECKPOINT_EVERY, budget_bytes=DEFAULT_HISTORY_BUDGET):
+        self.source = source
+        self.checkpoint_every = max(1, checkpoint_every)
+        self.budget_bytes = budget_bytes
+        self.operations = []
+        self.position = 0
+        self.nbytes = 0
+        self.replayed = 0
+        self._checkpoints = OrderedDict()  # step -> image
+        self._lock = threading.Lock()
+
+    def push(self, op):
+        # A new edit drops everything that could have been redone
+        with self._lock:
+            del self.operations[self.position:]
+            for step in [step for step in self._checkpoints if step > self.position]:
+                self.nbytes -= image_nbytes(self._checkpoints.pop(step))
+            self.operations.append(op)
+            self.position += 1
+        return self.current()
+
+    def can_undo(self):
+        return self.position > 0
+
+    def can_redo(self):
+        return self.position < len(self.operations)
+
+    def undo(self):
+        if self.can_undo():
+            self.position -= 1
+        return self.current()
+
+    def redo(self):
+        if self.can_redo():
+            self.position += 1
+        return self.current()
+
+    def current(self):
+        # The untouched source at step 0, so renders cached against it are reused after undoing everything
+        return self.source if self.position == 0 else EditedImageSource(self, self.position)
+
+    def size_at(self, step):
+        size = self.source.size
+        for op in self.operations[:step]:
+            size = operation_size(size, op)
+        return size
+
+    def preview_at(self, step):
+        # The operations applied to the source's preview proxy, scaled down: no full-resolution work
+        image = self.source.preview()
+        scale = image.width / self.source.size[0]
+        for op in self.operations[:step]:
+            image = apply_operation(image, op, scale)
+        return make_preview_proxy(image, PROXY_SIZE)
+
+    def image_at(self, step):
+        with self._lock:
+            start = max((checkpoint for checkpoint in self._checkpoints if checkpoint <= step), default=0)
+            if start:
+                self._checkpoints.move_to_end(start)
+                image = self._checkpoints[start]
+            else:
+                image = self.source.full()
+            for index in range(start, step):
+                image = apply_operation(image, self.operations[index])
+                self.replayed += 1
+                if (index + 1) % self.checkpoint_every == 0:
+                    self._store(index + 1, image)
+            return image
+
+    def _store(self, step, image):
+        if step in self._checkpoints:
+            return
+        self._checkpoints[step] = image
+        self.nbytes += image_nbytes(image)
+        while self.nbytes > self.budget_bytes and self._checkpoints:
+            _, evicted = self._checkpoints.popitem(last=False)
+            self.nbytes -= image_nbytes(evicted)
+
+    def stats(self):
+        with self._lock:
+            steps = len(self.operations)
+            return {'history_steps': steps, 'history_position': self.position,
+                    'history_checkpoints': len(self._checkpoints), 'history_mb': self.nbytes / (1024 * 1024),
+                    'history_mb_per_step': self.nbytes / (1024 * 1024) / steps if steps else 0.0,
+                    'history_replayed': self.replayed}
+
+
+class EditedImageSource(ImageSource):
+    # The source after the first `step` operations of a history. The preview is built from the
+    # source's proxy; the full image is replayed only when an export needs it.
+
+    def __init__(self, history, step):
+        self.history = history
+        self.step = step
+        self.size = history.size_at(step)
+        self._full = None
+        self._proxy = None
+        self._array = None
+        self._array_lock = threading.Lock()
+        self._replay_lock = threading.Lock()
+        self._thread = None
+
+    def full(self):
+        with self._replay_lock:
+            if self._full is None:
+                self._full = self.history.image_at(self.step)
+            return self._full
+
+    def preview(self):
+        if self._proxy is None:
+            self._proxy = self.history.preview_at(self.step)
+        return self._proxy
+
+    def start_full_decode(self):
+        if self._thread is None and self._full is None:
+            self._thread = threading.Thread(target=self.full, name="memepic-replay", daemon=True)
+            self._thread.start()
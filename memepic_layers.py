@@ -0,0 +1,186 @@
+"""Layered preview compositing: base, box, text and transparency layers cached independently."""
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from memepic_render import (PREVIEW_SIZE, blend_box, draw_line, frame_to_image, layout_caption, line_extent, parse_color,
+                            resize_image, source_array)
+from memepic_trace import span
+from memepic_truetype import blend_over
+from memepic_transparency import apply_key_mask, border_connected, white_key_mask
+
+DEFAULT_LAYER_BUDGET = 256 * 1024 * 1024
+
+
+def layer_nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(layer_nbytes(item) for item in value)
+    return 0
+
+
+class LayerCache:
+    # LRU over every layer of every image, bounded by the total size of the cached arrays
+
+    def __init__(self, budget_bytes=DEFAULT_LAYER_BUDGET):
+        self.budget_bytes = budget_bytes
+        self.nbytes = 0
+        self.evictions = 0
+        self.hits = {}
+        self.misses = {}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kind, key, build):
+        cache_key = (kind, key)
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None:
+                self._entries.move_to_end(cache_key)
+                self.hits[kind] = self.hits.get(kind, 0) + 1
+                return entry[0]
+            self.misses[kind] = self.misses.get(kind, 0) + 1
+        value = build()
+        size = layer_nbytes(value)
+        with self._lock:
+            if cache_key not in self._entries and size <= self.budget_bytes:
+                self._entries[cache_key] = (value, size)
+                self.nbytes += size
+                while self.nbytes > self.budget_bytes:
+                    _, (_, evicted_size) = self._entries.popitem(last=False)
+                    self.nbytes -= evicted_size
+                    self.evictions += 1
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = {'layer_entries': len(self._entries), 'layer_mb': self.nbytes / (1024 * 1024),
+                     'layer_evictions': self.evictions}
+            for kind in sorted(set(self.hits) | set(self.misses)):
+                hits, misses = self.hits.get(kind, 0), self.misses.get(kind, 0)
+                stats[f'{kind}_hit_rate'] = hits / (hits + misses)
+            return stats
+
+
+class LayeredRenderer:
+    # The caption is split into layers keyed only by the parameters each one depends on:
+    #   base  - the image pixels (and its white-key mask for transparency)
+    #   box   - the blended box rectangle: box color/opacity/width and the caption's vertical extent
+    #   text  - outline + fill for all lines on a transparent tile: text, font, colors, outline
+    # Moving the caption only re-blends the box and pastes the same text tile at a new offset;
+    # a color change rebuilds only the text tile.
+
+    def __init__(self, cache=None):
+        self.cache = cache or LayerCache()
+
+    # Entries keyed on id(image) hold the image too, so that id cannot be reused by a new proxy
+    # while the entry is cached, whichever entry LRU eviction drops first
+
+    def base_layer(self, image):
+        return self.cache.get('base', (id(image), image.size), lambda: (image, source_array(image)))[1]
+
+    def base_white_mask(self, image, base_np, tolerance):
+        return self.cache.get('mask', (id(image), image.size, tolerance), lambda: (image, white_key_mask(base_np, tolerance)))[1]
+
+    def text_layer(self, layout, spec, origins):
+        first_x, first_y = origins[0][1]
+        relative = tuple((line, x - first_x, y - first_y) for line, (x, y) in origins)
+        key = (relative, layout.font_scale, layout.font_thickness, layout.outline_thickness, spec.font_color,
+               spec.outline_color, spec.outline_engine, spec.outline_kernel, spec.font)
+        return self.cache.get('text', key, lambda: self.build_text_layer(relative, layout, spec))
+
+    def build_text_layer(self, relative, layout, spec):
+        boxes = []
+        for line, dx, dy in relative:
+            line_left, line_top, line_right, line_bottom = line_extent(line, layout, spec)
+            boxes.append((dx + line_left, dy + line_top, dx + line_right, dy + line_bottom))
+        left = min(box[0] for box in boxes)
+        top = min(box[1] for box in boxes)
+        right = max(box[2] for box in boxes)
+        bottom = max(box[3] for box in boxes)
+
+        tile = np.zeros((max(0, bottom - top), max(0, right - left), 4), np.uint8)
+        font_color = parse_color(spec.font_color)
+        outline_color = parse_color(spec.outline_color) if spec.outline_color and layout.outline_thickness > 0 else None
+        for line, dx, dy in relative:
+            draw_line(tile, line, (dx - left, dy - top), layout, spec, font_color, outline_color)
+        return tile, (left, top)
+
+    def box_layer(self, image, base_np, rect, spec):
+        key = (id(image), image.size, rect, spec.box_color, spec.box_opacity)
+        return self.cache.get('box', key, lambda: (image, self.build_box_layer(base_np, rect, spec)))[1]
+
+    def build_box_layer(self, base_np, rect, spec):
+        rect_left, rect_top, rect_right, rect_bottom = rect
+        region = base_np[rect_top:rect_bottom + 1, rect_left:rect_right + 1].copy()
+        blend_box(region, (0, 0, region.shape[1] - 1, region.shape[0] - 1), parse_color(spec.box_color), spec.box_opacity)
+        return region
+
+    def render(self, image, spec, full_size=None):
+        base_np = self.base_layer(image)
+        image_height, image_width = base_np.shape[:2]
+        full_size = full_size or (image_width, image_height)
+        result = base_np.copy()
+        touched = []
+
+        with span('layout'):
+            layout = layout_caption(full_size[0], full_size[1], spec)
+        if layout is not None:
+            if full_size != (image_width, image_height):
+                layout = layout.scaled(image_width / full_size[0])
+
+            if spec.use_box:
+                rect = layout.box_rect(spec.box_width)
+                with span('box_blend'):
+                    box = self.box_layer(image, base_np, rect, spec)
+                result[rect[1]:rect[1] + box.shape[0], rect[0]:rect[0] + box.shape[1]] = box
+                touched.append((rect[0], rect[1], rect[0] + box.shape[1], rect[1] + box.shape[0]))
+
+            origins = list(layout.line_origins())
+            if origins:
+                with span('text_layer'):
+                    tile, (tile_left, tile_top) = self.text_layer(layout, spec, origins)
+                left, top = origins[0][1][0] + tile_left, origins[0][1][1] + tile_top
+                x0, y0 = max(0, left), max(0, top)
+                x1, y1 = min(image_width, left + tile.shape[1]), min(image_height, top + tile.shape[0])
+                if x0 < x1 and y0 < y1:
+                    tile_region = tile[y0 - top:y1 - top, x0 - left:x1 - left]
+                    if spec.font:
+                        # Antialiased glyph edges are partly transparent in the tile
+                        blend_over(result[y0:y1, x0:x1], tile_region[:, :, :3], tile_region[:, :, 3])
+                    else:
+                        drawn = tile_region[:, :, 3] > 0
+                        result[y0:y1, x0:x1][drawn] = tile_region[drawn]
+                    touched.append((x0, y0, x1, y1))
+
+        if spec.transparency:
+            with span('transparency'):
+                self.apply_transparency(image, base_np, result, touched, spec)
+
+        return frame_to_image(result)
+
+    def apply_transparency(self, image, base_np, result, touched, spec):
+        # Only the regions the caption touched differ from the cached base mask
+        tolerance = spec.transparency_tolerance
+        mask = self.base_white_mask(image, base_np, tolerance)
+        if touched:
+            mask = mask.copy()
+            for x0, y0, x1, y1 in touched:
+                mask[y0:y1, x0:x1] = white_key_mask(result[y0:y1, x0:x1], tolerance)
+        if spec.transparency_mode == 'border':
+            mask = border_connected(mask)
+        apply_key_mask(result, mask)
+
+    def render_preview(self, proxy, spec, full_size, max_size=PREVIEW_SIZE):
+        with span('preview'):
+            return resize_image(self.render(proxy, spec, full_size), max_size, max_size)
+
+    def stats(self):
+        return self.cache.stats()
@@ -0,0 +1,505 @@
+"""Tk-free caption rendering shared by the MEMEPIC app and the command-line tools."""
+import copy
+from functools import lru_cache
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import memepic_truetype
+from memepic_trace import span
+from memepic_transparency import TRANSPARENCY_MODES, key_in_place
+
+FONT = cv2.FONT_HERSHEY_SIMPLEX
+LINE_PADDING = 9  # Padding between lines, in pixels
+PREVIEW_SIZE = 300
+PREVIEW_SUPERSAMPLE = 2  # Render the preview caption at 2x the label size, then downsample
+
+# 'compat' matches the original per-offset putText outline pixel-for-pixel, 'dilate' grows the fill
+# mask instead (slightly different, rounder look), 'loop' is the original O(t^2) putText loop.
+OUTLINE_ENGINES = ('compat', 'dilate', 'loop')
+OUTLINE_KERNELS = ('square', 'round')
+
+
+def parse_color(color_str, default='0,0,0'):
+    return tuple(int(c) for c in (color_str or default).split(',')[:3])
+
+
+class CaptionSpec:
+    FIELDS = ('slogan', 'font_color', 'font_thickness', 'font_scale', 'outline_color', 'outline_thickness',
+              'box_color', 'box_opacity', 'text_position', 'box_width', 'transparency', 'outline_engine',
+              'outline_kernel', 'transparency_tolerance', 'transparency_mode', 'font')
+    # Fields that only affect how the finished frame is keyed, not the drawn caption
+    TRANSPARENCY_FIELDS = ('transparency', 'transparency_tolerance', 'transparency_mode')
+
+    def __init__(self, slogan='', font_color='255,255,255', font_thickness=1, font_scale=1, outline_color='0,0,0',
+                 outline_thickness=0, box_color='0,0,0', box_opacity=0.0, text_position=0, box_width=50,
+                 transparency=False, outline_engine='compat', outline_kernel='square', transparency_tolerance=0,
+                 transparency_mode='all', font=''):
+        self.slogan = slogan
+        self.font_color = font_color or '255,255,255'
+        self.font_thickness = int(font_thickness)
+        self.font_scale = font_scale
+        self.outline_color = outline_color or '0,0,0'
+        self.outline_thickness = int(outline_thickness)
+        self.box_color = box_color or '0,0,0'
+        self.box_opacity = float(box_opacity)
+        self.text_position = text_position
+        self.box_width = box_width
+        self.transparency = bool(transparency)
+        if outline_engine not in OUTLINE_ENGINES:
+            raise ValueError(f"Unknown outline engine: {outline_engine}")
+        if outline_kernel not in OUTLINE_KERNELS:
+            raise ValueError(f"Unknown outline kernel: {outline_kernel}")
+        self.outline_engine = outline_engine
+        self.outline_kernel = outline_kernel
+        if transparency_mode not in TRANSPARENCY_MODES:
+            raise ValueError(f"Unknown transparency mode: {transparency_mode}")
+        self.transparency_tolerance = int(transparency_tolerance)
+        self.transparency_mode = transparency_mode
+        self.font = font or ''  # a TrueType/OpenType font file; empty for the built-in Hershey font
+
+    @property
+    def use_box(self):
+        return self.box_opacity > 0
+
+    def to_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def caption_key(self):
+        return tuple(getattr(self, field) for field in self.FIELDS if field not in self.TRANSPARENCY_FIELDS)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{field: data[field] for field in cls.FIELDS if field in data})
+
+    @classmethod
+    def from_config(cls, config):
+        # config.json stores the OUTLINE slider value + 2, and the box opacity as a percentage
+        outline_slider = config.get('outline_thickness', 3) - 2
+        return cls(
+            slogan=config.get('slogan', ''),
+            font_color=config.get('font_color', '255,255,255'),
+            font_thickness=config.get('font_thickness', 1),
+            font_scale=config.get('font_size', 1),
+            outline_color=config.get('outline_color', '0,0,0'),
+            outline_thickness=outline_slider + 2 if outline_slider > 0 else 0,
+            box_color=config.get('box_color', '0,0,0'),
+            box_opacity=config.get('box_opacity', 0) / 100.0,
+            text_position=config.get('text_position', 0),
+            box_width=config.get('box_width', 50),
+            transparency=config.get('transparency', 0) == 1,
+            outline_engine=config.get('outline_engine', 'compat'),
+            outline_kernel=config.get('outline_kernel', 'square'),
+            transparency_tolerance=config.get('transparency_tolerance', 0),
+            transparency_mode=config.get('transparency_mode', 'all'),
+            font=config.get('font', ''),
+        )
+
+    def __repr__(self):
+        return f"CaptionSpec({self.to_dict()!r})"
+
+
+FLOAT_FIELDS = ('font_scale', 'box_opacity')
+INT_FIELDS = ('font_thickness', 'outline_thickness', 'text_position', 'box_width', 'transparency_tolerance')
+
+
+def parse_bool(value):
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def row_overrides(row):
+    # CSV cells are all strings and may be empty; JSONL values are already typed
+    overrides = {}
+    for field in CaptionSpec.FIELDS:
+        value = row.get(field)
+        if value is None or value == '':
+            continue
+        if field in FLOAT_FIELDS:
+            value = float(value)
+        elif field in INT_FIELDS:
+            value = int(value)
+        elif field == 'transparency':
+            value = parse_bool(value)
+        overrides[field] = value
+    return overrides
+
+
+def load_rgba(image_path):
+    return Image.open(image_path).convert("RGBA")
+
+
+def resize_image(image, max_width, max_height):
+    width_ratio = max_width / image.width
+    height_ratio = max_height / image.height
+    new_ratio = min(width_ratio, height_ratio)
+    new_width = int(image.width * new_ratio)
+    new_height = int(image.height * new_ratio)
+    with span('resize'):
+        return image.resize((new_width, new_height), Image.LANCZOS)
+
+
+def create_polaroid(image, border_size=50):
+    width, height = image.size
+    new_width = width + 2 * border_size
+    new_height = height + 4 * border_size  # Increased bottom border
+    polaroid = Image.new('RGBA', (new_width, new_height), (255, 255, 255, 255))
+    polaroid.paste(image, (border_size, border_size))
+    return polaroid
+
+
+def make_transparent(image, tolerance=0, mode='all'):
+    frame = np.array(image.convert("RGBA") if image.mode != "RGBA" else image)
+    return frame_to_image(key_in_place(frame, tolerance, mode))
+
+
+def outline_kernel(radius, shape='square', hollow=False):
+    size = 2 * radius + 1
+    if shape == 'round':
+        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+    else:
+        kernel = np.ones((size, size), np.uint8)
+    if hollow:
+        kernel[radius, radius] = 0
+    return kernel
+
+
+def draw_outline_loop(image_np, line, org, font_scale, outline_color, outline_thickness):
+    line_x, line_y = org
+    for dx in range(-outline_thickness, outline_thickness + 1):
+        for dy in range(-outline_thickness, outline_thickness + 1):
+            if dx != 0 or dy != 0:
+                cv2.putText(image_np, line, (line_x + dx, line_y + dy), FONT, font_scale, outline_color + (255,), outline_thickness)
+
+
+def draw_outline(image_np, line, org, font_scale, font_thickness, outline_color, outline_thickness, engine='compat', kernel_shape='square'):
+    if engine == 'loop':
+        draw_outline_loop(image_np, line, org, font_scale, outline_color, outline_thickness)
+        return
+
+    # Rasterize the line once into a padded mask, then grow it with a single dilation instead of
+    # one putText per offset.
+    stroke = outline_thickness if engine == 'compat' else font_thickness
+    (text_width, text_height), baseline = cv2.getTextSize(line, FONT, font_scale, stroke)
+    margin = 2 * outline_thickness + stroke + 2
+    left = org[0] - margin
+    top = org[1] - text_height - margin
+    mask_height = text_height + baseline + 2 * margin
+    mask_width = text_width + 2 * margin
+    image_height, image_width = image_np.shape[:2]
+    x0, y0 = max(0, left), max(0, top)
+    x1, y1 = min(image_width, left + mask_width), min(image_height, top + mask_height)
+    if x0 >= x1 or y0 >= y1:
+        return
+
+    mask = np.zeros((mask_height, mask_width), np.uint8)
+    cv2.putText(mask, line, (org[0] - left, org[1] - top), FONT, font_scale, 255, stroke)
+    if engine == 'compat':
+        mask = compat_outline_mask(mask, line, org, font_scale, outline_thickness, (left, top), (x0, y0, x1, y1),
+                                   (image_width, image_height))
+    else:
+        mask = cv2.dilate(mask, outline_kernel(outline_thickness, kernel_shape))[y0 - top:y1 - top, x0 - left:x1 - left]
+    region = image_np[y0:y1, x0:x1]
+    region[mask > 0] = outline_color + (255,)
+
+
+def compat_outline_mask(mask, line, org, font_scale, outline_thickness, mask_origin, clip, image_size):
+    # Union of the text shifted by every non-zero (dx, dy), cropped to `clip` (the frame's part of
+    # the mask). OpenCV rasterizes a copy that crosses the frame edge differently from a translated
+    # one, so only the shifts whose copy stays clear of every edge come from the dilation; the rest
+    # (e.g. the outline above a caption at the very top) are drawn into the cropped mask one by one,
+    # clipped by the same frame edges as the original per-offset loop.
+    left, top = mask_origin
+    x0, y0, x1, y1 = clip
+    image_width, image_height = image_size
+    ink_x, ink_y, ink_width, ink_height = cv2.boundingRect(mask)
+    ink_left, ink_top = left + ink_x, top + ink_y
+    size = 2 * outline_thickness + 1
+    kernel = np.zeros((size, size), np.uint8)
+    clipped = []
+    for dx in range(-outline_thickness, outline_thickness + 1):
+        for dy in range(-outline_thickness, outline_thickness + 1):
+            if dx == 0 and dy == 0:
+                continue
+            # A pixel of slack: line polygons reach a little past the pixels they fill
+            if (ink_left + dx >= 1 and ink_top + dy >= 1 and ink_left + ink_width + dx <= image_width - 1
+                    and ink_top + ink_height + dy <= image_height - 1):
+                kernel[outline_thickness - dy, outline_thickness - dx] = 1  # dilation reads src at x - (dx, dy)
+            else:
+                clipped.append((dx, dy))
+    if kernel.any():
+        cropped = cv2.dilate(mask, kernel)[y0 - top:y1 - top, x0 - left:x1 - left].copy()
+    else:
+        cropped = np.zeros((y1 - y0, x1 - x0), np.uint8)  # OpenCV treats an empty kernel as identity
+    for dx, dy in clipped:
+        cv2.putText(cropped, line, (org[0] + dx - x0, org[1] + dy - y0), FONT, font_scale, 255, outline_thickness)
+    return cropped
+
+
+def blend_box(image_np, rect, box_color, box_opacity):
+    # Blend only the box's own slice of the image (a filled cv2.rectangle covers both end rows and
+    # columns) instead of copying and re-weighting the whole frame
+    rect_left, rect_top, rect_right, rect_bottom = rect
+    region = image_np[rect_top:rect_bottom + 1, rect_left:rect_right + 1]
+    if region.size == 0:
+        return
+    overlay = np.empty_like(region)
+    overlay[:] = box_color + (255,)
+    cv2.addWeighted(overlay, box_opacity, region, 1 - box_opacity, 0, dst=overlay)
+    region[:] = overlay
+
+
+class CaptionLayout:
+    # Positions are kept in full-resolution units and multiplied by `scale` when drawn, so a preview
+    # proxy places every line and the box exactly where the full render does.
+    def __init__(self, lines, font_scale, font_thickness, outline_thickness, line_height, line_spacing, line_padding,
+                 text_width, total_height, text_x, text_y, padding, image_width, image_height, line_widths=None,
+                 baseline=0):
+        self.lines = lines
+        self.font_scale = font_scale
+        self.font_thickness = font_thickness
+        self.outline_thickness = outline_thickness
+        self.line_height = line_height
+        self.line_spacing = line_spacing
+        self.line_padding = line_padding
+        self.text_width = text_width
+        self.total_height = total_height
+        self.text_x = text_x
+        self.text_y = text_y
+        self.padding = padding
+        self.image_width = image_width
+        self.image_height = image_height
+        self.line_widths = line_widths or [text_width] * len(lines)
+        self.baseline = baseline
+        self.scale = 1.0
+
+    def _scale_point(self, x, y):
+        if self.scale == 1.0:
+            return x, y
+        return int(round(x * self.scale)), int(round(y * self.scale))
+
+    def line_origins(self):
+        step = self.line_height + self.line_spacing + self.line_padding
+        for i, line in enumerate(self.lines):
+            line_y = self.text_y + i * step
+            if 0 <= line_y <= self.image_height:
+                yield line, self._scale_point(self.text_x, line_y)  # Left-align the text within the box
+
+    def line_boxes(self):
+        # (left, top, right, bottom) of every drawn line, top at the cap height and bottom at the baseline descent
+        step = self.line_height + self.line_spacing + self.line_padding
+        boxes = []
+        for i, width in enumerate(self.line_widths):
+            line_y = self.text_y + i * step
+            if 0 <= line_y <= self.image_height:
+                boxes.append(self._scale_point(self.text_x, line_y - self.line_height)
+                             + self._scale_point(self.text_x + width, line_y + self.baseline))
+        return boxes
+
+    def box_rect(self, box_width):
+        box_width_pixels = int(self.image_width * (box_width / 100))
+        rect_left = max(0, (self.image_width - box_width_pixels) // 2)
+        rect_right = min(self.image_width, rect_left + box_width_pixels)
+        rect_top = max(0, self.text_y - self.line_height - self.padding - self.line_padding)
+        rect_bottom = min(self.image_height, self.text_y + self.total_height - self.line_height + self.padding + self.line_padding)
+        # right/bottom are inclusive, so scale the edge just past them: a box ending on row 287 at full
+        # size covers 288 rows and must cover 288 * scale rows in a preview, not one more
+        right, bottom = self._scale_point(rect_right + 1, rect_bottom + 1)
+        return self._scale_point(rect_left, rect_top) + (right - 1, bottom - 1)
+
+    def scaled(self, scale):
+        layout = copy.copy(self)
+        layout.scale = self.scale * scale
+        layout.font_scale = self.font_scale * scale
+        layout.font_thickness = max(1, int(round(self.font_thickness * scale)))
+        if self.outline_thickness > 0:
+            layout.outline_thickness = max(1, int(round(self.outline_thickness * scale)))
+        return layout
+
+
+@lru_cache(maxsize=8192)
+def text_size(text, font_scale, font_thickness, font=''):
+    # Per-line metrics: ((width, height), baseline)
+    if font:
+        return memepic_truetype.text_size(text, font, font_scale, font_thickness)
+    return cv2.getTextSize(text, FONT, font_scale, int(font_thickness))
+
+
+@lru_cache(maxsize=256)
+def fit_candidates(font_scale):
+    # The scales the original shrink loop steps through (font_scale -= 0.1 while font_scale > 0.5),
+    # accumulated the same way so the fitted scale is bit-for-bit the same float
+    candidates = [font_scale]
+    while font_scale > 0.5:
+        font_scale -= 0.1
+        candidates.append(font_scale)
+    return tuple(candidates)
+
+
+def lines_width(lines, font_scale, font_thickness, font=''):
+    return max(text_size(line, font_scale, font_thickness, font)[0][0] for line in lines)
+
+
+@lru_cache(maxsize=1024)
+def fit_font_scale(lines, font_scale, font_thickness, image_width, font=''):
+    # Largest candidate scale whose widest line fits, found by binary search (text width only
+    # grows with scale) instead of re-measuring every line at every 0.1 step
+    candidates = fit_candidates(font_scale)
+    unique_lines = tuple(set(lines))
+    if lines_width(unique_lines, candidates[0], font_thickness, font) <= image_width:
+        return candidates[0]
+    low, high = 1, len(candidates) - 1
+    if lines_width(unique_lines, candidates[high], font_thickness, font) > image_width:
+        return candidates[high]
+    while low < high:
+        middle = (low + high) // 2
+        if lines_width(unique_lines, candidates[middle], font_thickness, font) <= image_width:
+            high = middle
+        else:
+            low = middle + 1
+    return candidates[low]
+
+
+def layout_caption(image_width, image_height, spec):
+    lines = spec.slogan.split('\n')
+    if all(line == '' for line in lines):
+        return None
+
+    font_thickness = spec.font_thickness
+    font_scale = fit_font_scale(tuple(lines), spec.font_scale, font_thickness, image_width, spec.font)
+
+    (_, max_line_height), baseline = text_size('Tg', font_scale, font_thickness, spec.font)
+    line_widths = [text_size(line, font_scale, font_thickness, spec.font)[0][0] for line in lines]
+    text_width = max(line_widths)
+    text_height = max_line_height * len(lines)
+    line_spacing = int(max_line_height * 0.3)
+    line_padding = LINE_PADDING
+    total_height = text_height + (len(lines) - 1) * (line_spacing + line_padding)
+
+    text_position = spec.text_position / 100.0
+    text_y = int(text_position * (image_height - total_height)) + max_line_height
+
+    text_x = (image_width - text_width) // 2
+
+    padding = int(max_line_height * 0.2)
+
+    return CaptionLayout(lines, font_scale, font_thickness, spec.outline_thickness, max_line_height, line_spacing,
+                         line_padding, text_width, total_height, text_x, text_y, padding, image_width, image_height,
+                         line_widths, baseline)
+
+
+def draw_caption(image_np, layout, spec):
+    font_color = parse_color(spec.font_color)
+    box_color = parse_color(spec.box_color)
+    outline_thickness = layout.outline_thickness
+    outline_color = parse_color(spec.outline_color) if spec.outline_color and outline_thickness > 0 else None
+
+    if spec.use_box:
+        with span('box_blend'):
+            blend_box(image_np, layout.box_rect(spec.box_width), box_color, spec.box_opacity)
+
+    for line, org in layout.line_origins():
+        draw_line(image_np, line, org, layout, spec, font_color, outline_color)
+
+
+def draw_line(image_np, line, org, layout, spec, font_color, outline_color):
+    # Outline, then fill over it: Hershey text through cv2, a TrueType font from the glyph atlas
+    outline_thickness = layout.outline_thickness
+    if outline_thickness > 0 and outline_color is not None:
+        with span('outline'):
+            if spec.font:
+                memepic_truetype.draw_outline(image_np, line, org, spec.font, layout.font_scale, layout.font_thickness, outline_color, outline_thickness)
+            else:
+                draw_outline(image_np, line, org, layout.font_scale, layout.font_thickness, outline_color, outline_thickness, spec.outline_engine, spec.outline_kernel)
+    with span('fill'):
+        if spec.font:
+            memepic_truetype.draw_text(image_np, line, org, spec.font, layout.font_scale, layout.font_thickness, font_color)
+        else:
+            cv2.putText(image_np, line, org, FONT, layout.font_scale, font_color + (255,), layout.font_thickness)
+
+
+def line_extent(line, layout, spec):
+    # (left, top, right, bottom) around everything draw_line paints, relative to the line origin
+    outline_thickness = layout.outline_thickness
+    if spec.font:
+        return memepic_truetype.line_extent(line, spec.font, layout.font_scale, layout.font_thickness, outline_thickness)
+    stroke = max(layout.font_thickness, outline_thickness)
+    margin = 2 * outline_thickness + stroke + 2
+    (text_width, text_height), baseline = cv2.getTextSize(line, FONT, layout.font_scale, stroke)
+    return -margin, -text_height - margin, text_width + margin, baseline + margin
+
+
+def source_array(image):
+    # Read-only RGBA view of a decoded image. Renders copy it once (copy-on-write) and never mutate it.
+    if isinstance(image, np.ndarray):
+        return image
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    return np.asarray(image)
+
+
+def frame_to_image(frame):
+    # Zero-copy PIL view over an RGBA frame, for display and encoding
+    height, width = frame.shape[:2]
+    with span('to_image'):
+        return Image.frombuffer("RGBA", (width, height), np.ascontiguousarray(frame), "raw", "RGBA", 0, 1)
+
+
+def render_frame(image, spec, layout=None, apply_transparency=True, key_cache=None):
+    source = source_array(image)
+    if source.ndim != 3 or source.shape[2] not in (3, 4):
+        print("Unsupported image format")
+        return None
+    # The single full-frame copy of the pipeline; everything after it works in place
+    with span('frame_copy'):
+        frame = cv2.cvtColor(source, cv2.COLOR_RGB2RGBA) if source.shape[2] == 3 else source.copy()
+
+    if layout is None:
+        image_height, image_width = frame.shape[:2]
+        with span('layout'):
+            layout = layout_caption(image_width, image_height, spec)
+    if layout is not None:
+        draw_caption(frame, layout, spec)
+    if apply_transparency and spec.transparency:
+        with span('transparency'):
+            if key_cache is not None:
+                key = (id(source), source.shape, spec.caption_key())
+                key_cache.key_in_place(key, frame, spec.transparency_tolerance, spec.transparency_mode, owner=source)
+            else:
+                key_in_place(frame, spec.transparency_tolerance, spec.transparency_mode)
+    return frame
+
+
+def add_slogan_to_image(image, spec, layout=None):
+    if image is None:
+        print("No image loaded.")
+        return None
+    frame = render_frame(image, spec, layout, apply_transparency=False)
+    return frame_to_image(frame) if frame is not None else None
+
+
+def render_caption(image, spec):
+    if image is None:
+        print("No image loaded.")
+        return None
+    frame = render_frame(image, spec)
+    return frame_to_image(frame) if frame is not None else None
+
+
+def make_preview_proxy(image, max_size=PREVIEW_SIZE * PREVIEW_SUPERSAMPLE):
+    if image.width <= max_size and image.height <= max_size:
+        return image
+    return resize_image(image, max_size, max_size)
+
+
+def render_preview(proxy, spec, full_size, max_size=PREVIEW_SIZE):
+    # Lay the caption out against the full-resolution size, then draw it scaled onto the proxy
+    layout = layout_caption(full_size[0], full_size[1], spec)
+    if layout is not None:
+        layout = layout.scaled(proxy.width / full_size[0])
+    frame = render_frame(proxy, spec, layout)
+    if frame is None:
+        return None
+    return resize_image(frame_to_image(frame), max_size, max_size)
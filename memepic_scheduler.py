@@ -0,0 +1,135 @@
+"""Background render scheduler that keeps only the newest preview request (no Tk dependency)."""
+import threading
+import time
+from collections import deque
+
+
+class RenderScheduler:
+    # A single worker thread renders the most recent request. Requests submitted while another is
+    # still waiting replace it, so a slider drag renders a frame every max_delay at most instead of
+    # queueing one per tick. Finished renders are handed back through poll(), which the app calls
+    # from the Tk main loop; cancel() discards everything submitted so far.
+
+    def __init__(self, render, debounce=0.03, max_delay=0.1):
+        self.render = render
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._condition = threading.Condition()
+        self._pending = None
+        self._generation = 0
+        self._cancelled_generation = 0
+        self._results = deque()
+        self._closed = False
+        self._busy = False
+        self.submitted = 0
+        self.rendered = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.latencies = deque(maxlen=200)
+        self._thread = threading.Thread(target=self._run, name="memepic-render", daemon=True)
+        self._thread.start()
+
+    def submit(self, callback, *args):
+        with self._condition:
+            self._generation += 1
+            self.submitted += 1
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (self._generation, callback, args, time.perf_counter())
+            self._condition.notify()
+            return self._generation
+
+    def cancel(self):
+        with self._condition:
+            self._cancelled_generation = self._generation
+            if self._pending is not None:
+                self.dropped += 1
+                self._pending = None
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._pending = None
+            self._condition.notify()
+        self._thread.join(timeout=1)
+
+    def _next_request(self):
+        with self._condition:
+            while self._pending is None and not self._closed:
+                self._condition.wait()
+            # Debounce: wait until submissions pause, but never hold a request longer than max_delay
+            first_seen = time.perf_counter()
+            while not self._closed and self._pending is not None:
+                generation = self._pending[0]
+                remaining = self.max_delay - (time.perf_counter() - first_seen)
+                if remaining <= 0:
+                    break
+                self._condition.wait(min(self.debounce, remaining))
+                if self._pending is not None and self._pending[0] == generation:
+                    break
+            if self._closed or self._pending is None:
+                return None
+            request, self._pending = self._pending, None
+            self._busy = True
+            return request
+
+    def _run(self):
+        while not self._closed:
+            request = self._next_request()
+            if request is None:
+                continue
+            generation, callback, args, submitted_at = request
+            try:
+                result, error = self.render(*args), None
+            except Exception as e:
+                result, error = None, e
+            with self._condition:
+                self._busy = False
+                self.rendered += 1
+                if generation <= self._cancelled_generation:
+                    self.dropped += 1
+                    continue
+                # Only the newest finished frame is worth showing
+                self.dropped += len(self._results)
+                self._results.clear()
+                self._results.append((generation, callback, result, error, submitted_at))
+
+    def poll(self):
+        while True:
+            with self._condition:
+                if not self._results:
+                    return
+                generation, callback, result, error, submitted_at = self._results.popleft()
+                if generation <= self._cancelled_generation:
+                    self.dropped += 1
+                    continue
+                self.delivered += 1
+                self.latencies.append(time.perf_counter() - submitted_at)
+            if error is not None:
+                print(f"Error rendering preview: {error}")
+            else:
+                callback(result)
+
+    def wait_idle(self, timeout=5.0):
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            with self._condition:
+                if self._pending is None and not self._busy:
+                    return True
+            time.sleep(0.005)
+        return False
+
+    def stats(self):
+        with self._condition:
+            latencies = sorted(self.latencies)
+            stats = {
+                'submitted': self.submitted,
+                'rendered': self.rendered,
+                'delivered': self.delivered,
+                'dropped': self.dropped,
+            }
+        if latencies:
+            stats['latency_ms_avg'] = sum(latencies) / len(latencies) * 1000
+            stats['latency_ms_p95'] = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+            stats['latency_ms_max'] = latencies[-1] * 1000
+        return stats
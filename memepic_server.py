@@ -0,0 +1,295 @@
+"""Localhost HTTP render service: asyncio front end, process-pool renders, spec-hash response cache."""
+import asyncio
+import hashlib
+import io
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+
+from PIL import Image, UnidentifiedImageError
+
+from memepic_export import ExportOptions, encode_image
+from memepic_render import CaptionSpec, frame_to_image, render_frame, row_overrides
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+DEFAULT_CACHE_BUDGET = 128 * 1024 * 1024
+MAX_BODY_BYTES = 64 * 1024 * 1024
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPES = {'png': 'image/png', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+STATUS_TEXT = {200: 'OK', 304: 'Not Modified', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+def render_encoded(image_bytes, spec_dict, options):
+    # Runs in a pool worker: decode, caption, encode, all from memory
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        frame = render_frame(image.convert("RGBA"), CaptionSpec.from_dict(spec_dict))
+    return encode_image(frame_to_image(frame), options)
+
+
+def render_key(image_bytes, spec, options):
+    digest = hashlib.sha256(image_bytes).hexdigest()
+    settings = json.dumps([spec.to_dict(), options.format, options.save_arguments()], sort_keys=True)
+    return hashlib.sha256(f"{digest}:{settings}".encode()).hexdigest()
+
+
+class ResponseCache:
+    # Encoded responses by render key, LRU within a byte budget
+
+    def __init__(self, budget_bytes=DEFAULT_CACHE_BUDGET):
+        self.budget_bytes = budget_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        body = self._entries.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def put(self, key, body):
+        if key in self._entries or len(body) > self.budget_bytes:
+            return
+        self._entries[key] = body
+        self.nbytes += len(body)
+        while self.nbytes > self.budget_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= len(evicted)
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.total += seconds
+        self.count += 1
+        for index, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[index] += 1
+
+    def exposition(self, name):
+        lines = [f'{name}_bucket{{le="{bound}"}} {count}' for bound, count in zip(self.buckets, self.counts)]
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum {self.total:.6f}')
+        lines.append(f'{name}_count {self.count}')
+        return lines
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class RenderService:
+    def __init__(self, base_spec=None, options=None, workers=None, cache_budget=DEFAULT_CACHE_BUDGET):
+        self.base_spec = base_spec or CaptionSpec()
+        self.options = options or ExportOptions()
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+        self.cache = ResponseCache(cache_budget)
+        self.started_at = time.time()
+        self.requests = {}  # (path, status) -> count
+        self.request_latency = Histogram()
+        self.render_latency = Histogram()
+        self.bytes_sent = 0
+        self.not_modified = 0
+        self._inflight = {}
+
+    def metrics(self):
+        lines = ['# TYPE memepic_requests_total counter']
+        for (path, status), count in sorted(self.requests.items()):
+            lines.append(f'memepic_requests_total{{path="{path}",status="{status}"}} {count}')
+        lines.append('# TYPE memepic_request_seconds histogram')
+        lines.extend(self.request_latency.exposition('memepic_request_seconds'))
+        lines.append('# TYPE memepic_render_seconds histogram')
+        lines.extend(self.render_latency.exposition('memepic_render_seconds'))
+        lines.extend([
+            '# TYPE memepic_cache_hits_total counter', f'memepic_cache_hits_total {self.cache.hits}',
+            '# TYPE memepic_cache_misses_total counter', f'memepic_cache_misses_total {self.cache.misses}',
+            '# TYPE memepic_cache_bytes gauge', f'memepic_cache_bytes {self.cache.nbytes}',
+            '# TYPE memepic_not_modified_total counter', f'memepic_not_modified_total {self.not_modified}',
+            '# TYPE memepic_response_bytes_total counter', f'memepic_response_bytes_total {self.bytes_sent}',
+            '# TYPE memepic_renders_in_flight gauge', f'memepic_renders_in_flight {len(self._inflight)}',
+            '# TYPE memepic_uptime_seconds gauge', f'memepic_uptime_seconds {time.time() - self.started_at:.1f}',
+        ])
+        return "\n".join(lines) + "\n"
+
+    def request_settings(self, query):
+        # Query parameters override the service's base caption spec and export options
+        data = self.base_spec.to_dict()
+        try:
+            data.update(row_overrides(query))
+            spec = CaptionSpec.from_dict(data)
+            options = ExportOptions(query.get('format', self.options.format),
+                                    query.get('compress_level', self.options.compress_level),
+                                    query.get('quality', self.options.quality))
+        except ValueError as e:
+            raise HttpError(400, str(e))
+        return spec, options
+
+    async def read_image(self, query, body):
+        if body:
+            return body
+        path = query.get('path')
+        if not path:
+            raise HttpError(400, "Send the image as the request body or pass ?path=")
+        try:
+            return await asyncio.to_thread(read_file, path)
+        except OSError as e:
+            raise HttpError(404, f"Cannot read {path}: {e.strerror}")
+
+    async def render(self, key, image_bytes, spec, options):
+        body = self.cache.get(key)
+        if body is not None:
+            return body
+        # Identical requests arriving together share one render
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._render(key, image_bytes, spec, options))
+            self._inflight[key] = future
+        return await asyncio.shield(future)
+
+    async def _render(self, key, image_bytes, spec, options):
+        start = time.perf_counter()
+        try:
+            body = await asyncio.get_running_loop().run_in_executor(
+                self.pool, render_encoded, image_bytes, spec.to_dict(), options)
+        except (ValueError, UnidentifiedImageError) as e:
+            raise HttpError(400, f"Cannot render image: {e}")
+        except Exception as e:
+            raise HttpError(500, f"Render failed: {e}")
+        finally:
+            self._inflight.pop(key, None)
+        self.render_latency.observe(time.perf_counter() - start)
+        self.cache.put(key, body)
+        return body
+
+    async def handle(self, method, target, headers, body):
+        url = urlsplit(target)
+        query = dict(parse_qsl(url.query))
+        if url.path == '/metrics':
+            return 200, {'Content-Type': 'text/plain; version=0.0.4'}, self.metrics().encode()
+        if url.path == '/health':
+            return 200, {'Content-Type': 'text/plain'}, b"ok\n"
+        if url.path != '/render':
+            raise HttpError(404, f"No such endpoint: {url.path}")
+        if method not in ('GET', 'POST'):
+            raise HttpError(405, f"{method} not allowed")
+        spec, options = self.request_settings(query)
+        image_bytes = await self.read_image(query, body)
+        # Hashing a large upload would stall the event loop; hashlib releases the GIL
+        key = await asyncio.to_thread(render_key, image_bytes, spec, options)
+        etag = f'"{key}"'
+        if etag in [tag.strip() for tag in headers.get('if-none-match', '').split(',')]:
+            # The key covers image content and every setting, so a matching tag is still current
+            self.not_modified += 1
+            return 304, {'ETag': etag}, b""
+        rendered = await self.render(key, image_bytes, spec, options)
+        return 200, {'Content-Type': CONTENT_TYPES[options.format], 'ETag': etag, 'Cache-Control': 'no-cache'}, rendered
+
+    async def serve_connection(self, reader, writer):
+        try:
+            while True:
+                request = await read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                start = time.perf_counter()
+                try:
+                    status, response_headers, response = await self.handle(method, target, headers, body)
+                except HttpError as e:
+                    status, response_headers, response = e.status, {'Content-Type': 'text/plain'}, f"{e}\n".encode()
+                except Exception as e:
+                    print(f"Error handling {method} {target}: {e}")
+                    status, response_headers, response = 500, {'Content-Type': 'text/plain'}, b"Internal error\n"
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                write_response(writer, status, response_headers, response, keep_alive)
+                await writer.drain()
+                path = urlsplit(target).path
+                self.requests[(path, status)] = self.requests.get((path, status), 0) + 1
+                self.request_latency.observe(time.perf_counter() - start)
+                self.bytes_sent += len(response)
+                if not keep_alive:
+                    break
+        except HttpError as e:
+            write_response(writer, e.status, {'Content-Type': 'text/plain'}, f"{e}\n".encode(), False)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Client went away, or the server is shutting down
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=DEFAULT_HOST, port=DEFAULT_PORT, ready=None):
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+        try:
+            server = await asyncio.start_server(self.serve_connection, host, port)
+            async with server:
+                bound = server.sockets[0].getsockname()
+                print(f"Serving captions on http://{bound[0]}:{bound[1]}/render ({self.workers} workers)")
+                if ready is not None:
+                    ready(bound)
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def read_file(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+async def read_request(reader):
+    request_line = await reader.readline()
+    if not request_line.strip():
+        return None
+    try:
+        method, target, _ = request_line.decode('latin-1').split(' ', 2)
+    except ValueError:
+        raise HttpError(400, "Malformed request line")
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    try:
+        length = int(headers.get('content-length') or 0)
+    except ValueError:
+        raise HttpError(400, "Invalid Content-Length")
+    if length < 0:
+        raise HttpError(400, "Invalid Content-Length")
+    if length > MAX_BODY_BYTES:
+        raise HttpError(413, f"Request body over {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target, headers, body
+
+
+def write_response(writer, status, headers, body, keep_alive=True):
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}", f"Content-Length: {len(body)}",
+             f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    lines.extend(f"{name}: {value}" for name, value in headers.items())
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode('latin-1') + body)
+
+
+def run_server(base_spec, options, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=None, cache_budget=DEFAULT_CACHE_BUDGET):
+    service = RenderService(base_spec, options, workers, cache_budget)
+    try:
+        asyncio.run(service.serve(host, port))
+    except KeyboardInterrupt:
+        pass
+    return 0
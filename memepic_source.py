@@ -0,0 +1,91 @@
+"""Image sources: a cheap reduced-resolution decode for the preview, full RGBA decode only on demand."""
+import threading
+
+from PIL import Image
+
+from memepic_animation import ANIMATED_FORMATS
+from memepic_trace import span
+from memepic_render import PREVIEW_SIZE, PREVIEW_SUPERSAMPLE, make_preview_proxy, source_array
+
+PROXY_SIZE = PREVIEW_SIZE * PREVIEW_SUPERSAMPLE
+
+
+class ImageSource:
+    # An image that is already decoded in memory (placeholders, polaroid results)
+
+    animated = False
+
+    def __init__(self, image):
+        self.size = image.size
+        self._full = image
+        self._proxy = None
+        self._array = None
+        self._array_lock = threading.Lock()
+
+    def full(self):
+        return self._full
+
+    def array(self):
+        # Read-only RGBA view of the full image, shared by every full-resolution render and export
+        with self._array_lock:
+            if self._array is None:
+                self._array = source_array(self.full())
+            return self._array
+
+    def preview(self):
+        if self._proxy is None:
+            self._proxy = make_preview_proxy(self._full, PROXY_SIZE)
+        return self._proxy
+
+    def start_full_decode(self):
+        pass
+
+
+class FileImageSource(ImageSource):
+    # Opening reads only the header. preview() decodes at reduced scale (JPEG DCT scaling via
+    # draft(), Image.reduce for other formats); full() does the full RGBA decode once, either when
+    # an export first needs it or in the background after start_full_decode().
+
+    def __init__(self, path):
+        self.path = path
+        with Image.open(path) as image:
+            self.size = image.size
+            self.format = image.format
+            self.animated = image.format in ANIMATED_FORMATS and getattr(image, 'n_frames', 1) > 1
+        self._full = None
+        self._proxy = None
+        self._array = None
+        self._array_lock = threading.Lock()
+        self._decode_lock = threading.Lock()
+        self._thread = None
+
+    def full(self):
+        with self._decode_lock:
+            if self._full is None:
+                with span('decode'), Image.open(self.path) as image:
+                    self._full = image.convert("RGBA")
+            return self._full
+
+    def preview(self):
+        if self._proxy is None:
+            full = self._full  # Reuse a finished full decode, but never wait for one in progress
+            self._proxy = make_preview_proxy(full if full is not None else self.decode_reduced(PROXY_SIZE), PROXY_SIZE)
+        return self._proxy
+
+    def decode_reduced(self, max_size):
+        with span('decode_reduced'), Image.open(self.path) as image:
+            if image.format == 'JPEG':
+                # Let libjpeg decode at 1/2, 1/4 or 1/8 scale, never below the requested size
+                image.draft('RGB', (max_size, max_size))
+                return image.convert("RGBA")
+            factor = min(image.width // max_size, image.height // max_size)
+            if image.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                image = image.convert("RGBA")
+            if factor > 1:
+                image = image.reduce(factor)
+            return image.convert("RGBA")
+
+    def start_full_decode(self):
+        if self._thread is None and self._full is None:
+            self._thread = threading.Thread(target=self.full, name="memepic-decode", daemon=True)
+            self._thread.start()
@@ -0,0 +1,213 @@
+"""Caption templating: many caption variants per source image, each image decoded once."""
+import csv
+import json
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+from PIL import Image
+
+from memepic_cache import pixel_digest, render_frame_cached
+from memepic_export import write_atomic, write_bytes_atomic
+from memepic_render import CaptionSpec, frame_to_image, load_rgba, render_frame, row_overrides
+
+DEFAULT_SHARED_BUDGET = 1024 * 1024 * 1024
+# Columns that aren't CaptionSpec fields
+ROW_COLUMNS = ('image', 'output')
+
+
+def read_rows(template_path):
+    if template_path.lower().endswith('.csv'):
+        with open(template_path, 'r', newline='', encoding='utf-8') as file:
+            rows = list(csv.DictReader(file))
+    else:
+        with open(template_path, 'r', encoding='utf-8') as file:
+            rows = [json.loads(line) for line in file if line.strip()]
+    unknown = set().union(*(row.keys() for row in rows)) - set(CaptionSpec.FIELDS) - set(ROW_COLUMNS) if rows else set()
+    if unknown:
+        print(f"Ignoring unknown template columns: {', '.join(sorted(unknown))}")
+    return rows
+
+
+def resolve_image_path(image, template_path):
+    # Relative image paths are taken relative to the template file
+    if os.path.isabs(image) or os.path.exists(image):
+        return image
+    return os.path.join(os.path.dirname(os.path.abspath(template_path)), image)
+
+
+class TemplateRow:
+    def __init__(self, index, image_path, spec_dict, output_path):
+        self.index = index
+        self.image_path = image_path
+        self.spec_dict = spec_dict
+        self.output_path = output_path
+
+
+def template_groups(template_path, base_spec, output_folder, extension=".png"):
+    # Rows grouped by source image, in order of first appearance
+    groups = OrderedDict()
+    base = base_spec.to_dict()
+    for index, row in enumerate(read_rows(template_path), 1):
+        image_path = resolve_image_path(str(row.get('image') or ''), template_path)
+        spec_dict = dict(base)
+        spec_dict.update(row_overrides(row))
+        stem = os.path.splitext(os.path.basename(image_path))[0]
+        output_name = row.get('output') or f"meme_{stem}_{index:04d}{extension}"
+        groups.setdefault(image_path, []).append(
+            TemplateRow(index, image_path, spec_dict, os.path.join(output_folder, output_name)))
+    return groups
+
+
+class SharedImage:
+    # A decoded RGBA frame in a shared-memory block, so worker processes map it instead of each
+    # decoding (or unpickling) its own copy
+
+    def __init__(self, image_path, digest=False):
+        start = time.perf_counter()
+        frame = np.asarray(load_rgba(image_path))
+        self.shape = frame.shape
+        self.nbytes = frame.nbytes
+        self._shm = SharedMemory(create=True, size=max(1, frame.nbytes))
+        np.ndarray(self.shape, np.uint8, buffer=self._shm.buf)[:] = frame
+        self.name = self._shm.name
+        self.digest = pixel_digest(frame) if digest else None
+        self.decode_seconds = time.perf_counter() - start
+
+    def release(self):
+        self._shm.close()
+        self._shm.unlink()
+
+
+def decoded_nbytes(image_path):
+    # RGBA size from the header alone, to budget shared memory before decoding
+    with Image.open(image_path) as image:
+        return image.width * image.height * 4
+
+
+# Per worker process: shared blocks this worker has mapped, most recent last
+_attached = OrderedDict()
+MAX_ATTACHED = 4
+
+
+def attached_frame(name, shape):
+    entry = _attached.get(name)
+    if entry is None:
+        shm = SharedMemory(name=name)
+        frame = np.ndarray(shape, np.uint8, buffer=shm.buf)
+        frame.flags.writeable = False
+        entry = _attached[name] = (shm, frame)
+        while len(_attached) > MAX_ATTACHED:
+            _, (old_shm, old_frame) = _attached.popitem(last=False)
+            del old_frame  # the view must go before the mapping can close
+            old_shm.close()
+    else:
+        _attached.move_to_end(name)
+    return entry[1]
+
+
+def render_row(shared_name, shape, spec_dict, output_path, options, cache=None, digest=None):
+    start = time.perf_counter()
+    spec = CaptionSpec.from_dict(spec_dict)
+    source = attached_frame(shared_name, shape)
+    attached = time.perf_counter()
+    if cache is not None:
+        # Render and encode happen together on a miss, so they are reported as one
+        data, hit = render_frame_cached(cache, digest, source, spec, options)
+        rendered = time.perf_counter()
+        nbytes = write_bytes_atomic(data, output_path)
+        done = time.perf_counter()
+        return {'pid': os.getpid(), 'attach_ms': (attached - start) * 1000, 'render_ms': (rendered - attached) * 1000,
+                'write_ms': (done - rendered) * 1000, 'bytes': nbytes, 'cache_hit': hit}
+    frame = render_frame(source, spec)
+    rendered = time.perf_counter()
+    nbytes = write_atomic(frame_to_image(frame), output_path, options)
+    done = time.perf_counter()
+    return {'pid': os.getpid(), 'attach_ms': (attached - start) * 1000, 'render_ms': (rendered - attached) * 1000,
+            'encode_ms': (done - rendered) * 1000, 'bytes': nbytes}
+
+
+def run_template(template_path, base_spec, output_folder, options, workers, manifest_path=None,
+                 shared_budget=DEFAULT_SHARED_BUDGET, verbose=False, cache=None):
+    # Images are decoded in this process while the pool renders earlier ones; at most
+    # `shared_budget` bytes of decoded images are live at once (always at least one)
+    groups = template_groups(template_path, base_spec, output_folder, options.extension)
+    total = sum(len(rows) for rows in groups.values())
+    if not total:
+        print("No template rows to render")
+        return 1
+    os.makedirs(output_folder, exist_ok=True)
+    manifest_path = manifest_path or os.path.join(output_folder, 'manifest.jsonl')
+
+    failures = 0
+    hits = 0
+    start = time.perf_counter()
+    with open(manifest_path, 'w', encoding='utf-8') as manifest, ProcessPoolExecutor(max_workers=workers) as pool:
+        def record(row, entry):
+            entry = dict({'row': row.index, 'image': row.image_path, 'output': row.output_path},
+                         **{key: round(value, 2) if isinstance(value, float) else value for key, value in entry.items()})
+            manifest.write(json.dumps(entry) + "\n")
+            manifest.flush()
+            if verbose and entry['status'] == 'ok':
+                print(f"Image saved to {row.output_path} ({entry['total_ms']:.0f} ms)")
+
+        pending = {}
+        live = {}  # image path -> [SharedImage, rows still rendering]
+        live_bytes = 0
+        queue = iter(groups.items())
+        next_group = next(queue, None)
+        while next_group is not None or pending:
+            while next_group is not None:
+                image_path, rows = next_group
+                try:
+                    nbytes = decoded_nbytes(image_path)
+                    if live and live_bytes + nbytes > shared_budget:
+                        break
+                    shared = SharedImage(image_path, digest=cache is not None)
+                except Exception as e:
+                    for row in rows:
+                        failures += 1
+                        record(row, {'status': 'error', 'error': f"decode: {e}"})
+                    print(f"Error decoding {image_path}: {e}")
+                    next_group = next(queue, None)
+                    continue
+                live[image_path] = [shared, len(rows)]
+                live_bytes += shared.nbytes
+                for row in rows:
+                    future = pool.submit(render_row, shared.name, shared.shape, row.spec_dict, row.output_path, options,
+                                         cache, shared.digest)
+                    pending[future] = (row, time.perf_counter())
+                next_group = next(queue, None)
+
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                row, submitted = pending.pop(future)
+                shared = live[row.image_path][0]
+                entry = {'decode_ms': shared.decode_seconds * 1000,
+                         'total_ms': (time.perf_counter() - submitted) * 1000}
+                try:
+                    entry.update(future.result())
+                    entry['status'] = 'ok'
+                    hits += entry.get('cache_hit', False)
+                except Exception as e:
+                    failures += 1
+                    entry.update({'status': 'error', 'error': str(e)})
+                    print(f"Error rendering row {row.index} ({row.image_path}): {e}")
+                record(row, entry)
+                live[row.image_path][1] -= 1
+                if live[row.image_path][1] == 0:
+                    live_bytes -= shared.nbytes
+                    shared.release()
+                    del live[row.image_path]
+    elapsed = time.perf_counter() - start
+
+    rendered = total - failures
+    rate = rendered / elapsed if elapsed > 0 else 0.0
+    print(f"Rendered {rendered}/{total} variants of {len(groups)} images in {elapsed:.2f}s "
+          f"({rate:.2f} images/sec, {workers} workers); manifest: {manifest_path}")
+    if cache is not None:
+        print(f"Render cache: {hits}/{total} hits ({hits / total:.0%})")
+    return 1 if failures else 0
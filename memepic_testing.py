@@ -0,0 +1,49 @@
+"""Measurements shared by the test suite and the benchmarks."""
+import tracemalloc
+
+import numpy as np
+
+from memepic_render import PREVIEW_SIZE, layout_caption, make_preview_proxy, render_frame, source_array
+
+SAMPLE_SLOGAN = "WHEN THE BUILD\nPASSES ON THE\nFIRST TRY"
+
+
+def caption_bbox(rendered, base):
+    changed = np.argwhere((np.asarray(rendered, dtype=np.int16) - np.asarray(base, dtype=np.int16)).any(axis=2))
+    if len(changed) == 0:
+        return None
+    (top, left), (bottom, right) = changed.min(axis=0), changed.max(axis=0)
+    return int(left), int(top), int(right), int(bottom)
+
+
+def peak_allocation(func):
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        result = func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+
+def preview_layout_error(image, spec):
+    # Largest distance, in preview pixels, between the caption's bounding box drawn on the proxy and
+    # drawn at full resolution. Boxes are measured before downsampling (resampling halos would blur
+    # the edges by a pixel or two either way) and then scaled to the label's size.
+    proxy = make_preview_proxy(image)
+    layout = layout_caption(image.width, image.height, spec)
+    full_box = caption_bbox(render_frame(image, spec, layout, apply_transparency=False), source_array(image))
+    if layout is not None:
+        layout = layout.scaled(proxy.width / image.width)
+    preview_box = caption_bbox(render_frame(proxy, spec, layout, apply_transparency=False), source_array(proxy))
+    if full_box is None or preview_box is None:
+        return 0 if full_box == preview_box else PREVIEW_SIZE
+
+    def to_preview(box, size):
+        # Edges rather than inclusive pixel indices, so right/bottom scale like left/top
+        scale = min(PREVIEW_SIZE / size[0], PREVIEW_SIZE / size[1])
+        left, top, right, bottom = box
+        return left * scale, top * scale, (right + 1) * scale, (bottom + 1) * scale
+
+    return max(abs(a - b) for a, b in zip(to_preview(full_box, image.size), to_preview(preview_box, proxy.size)))
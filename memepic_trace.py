@@ -0,0 +1,125 @@
+"""Opt-in per-stage timing: Chrome-trace spans and rolling percentiles for the render path."""
+import json
+import os
+import threading
+import time
+from collections import deque
+
+MAX_EVENTS = 100000
+WINDOW = 500  # recent durations kept per stage for percentiles
+
+
+class _NullSpan:
+    # Shared by every span while tracing is off: entering and leaving it does nothing
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ('tracer', 'name', 'args', 'start')
+
+    def __init__(self, tracer, name, args):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.tracer.record(self.name, self.start, time.perf_counter() - self.start, self.args)
+        return False
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.events = deque(maxlen=MAX_EVENTS)
+        self.durations = {}
+        self.thread_names = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return _Span(self, name, args)
+
+    def record(self, name, start, seconds, args=None):
+        thread = threading.current_thread()
+        with self._lock:
+            self.events.append((name, start, seconds, thread.ident, args))
+            self.thread_names[thread.ident] = thread.name
+            window = self.durations.get(name)
+            if window is None:
+                window = self.durations[name] = deque(maxlen=WINDOW)
+            window.append(seconds)
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self._lock:
+            self.events.clear()
+            self.durations.clear()
+
+    def percentiles(self):
+        # {stage: {count, p50_ms, p95_ms, p99_ms, max_ms}} over each stage's recent window
+        with self._lock:
+            windows = {name: sorted(window) for name, window in self.durations.items()}
+        stats = {}
+        for name, values in sorted(windows.items()):
+            count = len(values)
+            stats[name] = {'count': count,
+                           'p50_ms': values[int(0.50 * (count - 1))] * 1000,
+                           'p95_ms': values[int(0.95 * (count - 1))] * 1000,
+                           'p99_ms': values[int(0.99 * (count - 1))] * 1000,
+                           'max_ms': values[-1] * 1000}
+        return stats
+
+    def summary(self):
+        lines = [f"{'stage':<16} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+        for name, row in self.percentiles().items():
+            lines.append(f"{name:<16} {row['count']:>6} {row['p50_ms']:>9.2f} {row['p95_ms']:>9.2f} "
+                         f"{row['p99_ms']:>9.2f} {row['max_ms']:>9.2f}")
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        # Trace Event Format: complete ('X') events in microseconds, loadable in chrome://tracing or Perfetto
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+        trace = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                 for tid, name in thread_names.items()]
+        for name, start, seconds, tid, args in events:
+            event = {'name': name, 'cat': 'memepic', 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': round((start - self._origin) * 1e6, 3), 'dur': round(seconds * 1e6, 3)}
+            if args:
+                event['args'] = args
+            trace.append(event)
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def write_chrome_trace(self, path):
+        with open(path, 'w') as file:
+            json.dump(self.chrome_trace(), file)
+        return path
+
+
+TRACER = Tracer()
+
+
+def span(name, **args):
+    return TRACER.span(name, **args) if TRACER.enabled else NULL_SPAN
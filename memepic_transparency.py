@@ -0,0 +1,124 @@
+"""White-background keying into the alpha channel of an RGBA frame, in place."""
+import threading
+import weakref
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+TRANSPARENCY_MODES = ('all', 'border')
+CHUNK_ROWS = 256
+WHITE = 0x00FFFFFF  # R, G, B bytes of a little-endian packed RGBA pixel
+DEFAULT_KEY_MASK_BUDGET = 32 * 1024 * 1024
+
+
+def packed_rgba(frame):
+    # One uint32 per pixel, viewed over the same memory
+    return np.ascontiguousarray(frame).view('<u4')[:, :, 0]
+
+
+def chunk_key_mask(chunk, packed_chunk, tolerance):
+    if tolerance <= 0:
+        # Exact white: a single integer compare per pixel instead of a 3-channel broadcast
+        return (packed_chunk | 0xFF000000) == 0xFFFFFFFF
+    # Within `tolerance` of white on every channel (Chebyshev distance)
+    threshold = 255 - tolerance
+    mask = chunk[:, :, 0] >= threshold
+    mask &= chunk[:, :, 1] >= threshold
+    mask &= chunk[:, :, 2] >= threshold
+    return mask
+
+
+def white_key_mask(frame, tolerance=0, mode='all'):
+    if mode not in TRANSPARENCY_MODES:
+        raise ValueError(f"Unknown transparency mode: {mode}")
+    height = frame.shape[0]
+    packed = packed_rgba(frame) if tolerance <= 0 else None
+    mask = np.empty(frame.shape[:2], dtype=bool)
+    # Row chunks keep the comparison temporaries small on very large frames
+    for top in range(0, height, CHUNK_ROWS):
+        bottom = min(height, top + CHUNK_ROWS)
+        mask[top:bottom] = chunk_key_mask(frame[top:bottom], packed[top:bottom] if packed is not None else None, tolerance)
+    if mode == 'border':
+        mask = border_connected(mask)
+    return mask
+
+
+def border_connected(mask):
+    # Keep only the keyed regions that touch the image border (4-connected), so white text or
+    # highlights inside the picture stay opaque
+    count, labels = cv2.connectedComponents(mask.view(np.uint8), connectivity=4)
+    if count <= 1:
+        return mask
+    border_labels = np.unique(np.concatenate([labels[0], labels[-1], labels[:, 0], labels[:, -1]]))
+    keep = np.zeros(count, dtype=bool)
+    keep[border_labels] = True
+    keep[0] = False
+    return keep[labels]
+
+
+def apply_key_mask(frame, mask):
+    frame[:, :, 3][mask] = 0
+    return frame
+
+
+def key_in_place(frame, tolerance=0, mode='all'):
+    if mode == 'all':
+        # No full-size mask needed: key each chunk straight into the alpha channel
+        height = frame.shape[0]
+        packed = packed_rgba(frame) if tolerance <= 0 else None
+        for top in range(0, height, CHUNK_ROWS):
+            bottom = min(height, top + CHUNK_ROWS)
+            chunk = frame[top:bottom]
+            chunk[:, :, 3][chunk_key_mask(chunk, packed[top:bottom] if packed is not None else None, tolerance)] = 0
+        return frame
+    return apply_key_mask(frame, white_key_mask(frame, tolerance, mode))
+
+
+class KeyMaskCache:
+    # Key masks by caller-supplied key (the render's source and caption settings), so toggling
+    # Transparency or re-exporting the same render reuses the mask instead of recomputing it.
+    # LRU bounded by the total size of the cached masks (one byte per pixel).
+
+    def __init__(self, budget_bytes=DEFAULT_KEY_MASK_BUDGET):
+        self.budget_bytes = budget_bytes
+        self.nbytes = 0
+        self.evictions = 0
+        self.hits = 0
+        self.misses = 0
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()
+
+    def mask(self, key, frame, tolerance=0, mode='all', owner=None):
+        # `owner` is the object whose id() the key uses (e.g. the source array); a weak reference to
+        # it is stored so an entry for a freed image is never matched by a new one at the same id
+        cache_key = (key, tolerance, mode)
+        with self._lock:
+            entry = self._masks.get(cache_key)
+            if entry is not None and (entry[0] is None or entry[0]() is owner):
+                self._masks.move_to_end(cache_key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        mask = white_key_mask(frame, tolerance, mode)
+        with self._lock:
+            if mask.nbytes <= self.budget_bytes:
+                previous = self._masks.pop(cache_key, None)
+                if previous is not None:
+                    self.nbytes -= previous[1].nbytes
+                self._masks[cache_key] = (weakref.ref(owner) if owner is not None else None, mask)
+                self.nbytes += mask.nbytes
+                while self.nbytes > self.budget_bytes:
+                    _, (_, evicted) = self._masks.popitem(last=False)
+                    self.nbytes -= evicted.nbytes
+                    self.evictions += 1
+        return mask
+
+    def key_in_place(self, key, frame, tolerance=0, mode='all', owner=None):
+        return apply_key_mask(frame, self.mask(key, frame, tolerance, mode, owner))
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'key_mask_hit_rate': self.hits / total if total else 0.0, 'key_mask_entries': len(self._masks),
+                    'key_mask_mb': self.nbytes / (1024 * 1024), 'key_mask_evictions': self.evictions}
@@ -0,0 +1,194 @@
+"""TrueType/OpenType caption text: each glyph is rasterized once per (font, size, stroke) and lines are composed from the cached bitmaps."""
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+PIXELS_PER_SCALE = 32  # font size in pixels at font_scale 1, about the cap height of the Hershey font
+DEFAULT_ATLAS_BUDGET = 32 * 1024 * 1024
+
+
+@lru_cache(maxsize=64)
+def load_font(font, size):
+    # A path, or a file name Pillow finds in the system font folders (e.g. impact.ttf on Windows)
+    try:
+        return ImageFont.truetype(font, size)
+    except OSError:
+        raise ValueError(f"Cannot load font: {font}")
+
+
+def font_pixel_size(font_scale):
+    return max(1, int(round(font_scale * PIXELS_PER_SCALE)))
+
+
+def fill_stroke(font_thickness):
+    # Thickness 1 is the font's own weight; each step above emboldens the glyphs by a pixel
+    return max(0, int(font_thickness) - 1)
+
+
+class GlyphAtlas:
+    # Glyph coverage masks by (font, size, stroke, character), LRU within a byte budget. A mask is
+    # stored with its offset from the pen position on the baseline.
+
+    def __init__(self, budget_bytes=DEFAULT_ATLAS_BUDGET):
+        self.budget_bytes = budget_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def glyph(self, font, size, stroke, char):
+        key = (font, size, stroke, char)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        entry = rasterize_glyph(load_font(font, size), stroke, char)
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = entry
+                self.nbytes += entry[0].nbytes
+                while self.nbytes > self.budget_bytes and len(self._entries) > 1:
+                    _, (evicted, _, _) = self._entries.popitem(last=False)
+                    self.nbytes -= evicted.nbytes
+                    self.evictions += 1
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'glyph_entries': len(self._entries), 'glyph_mb': self.nbytes / (1024 * 1024),
+                    'glyph_evictions': self.evictions, 'glyph_hit_rate': self.hits / total if total else 0.0}
+
+
+ATLAS = GlyphAtlas()
+
+
+def rasterize_glyph(face, stroke, char):
+    left, top, right, bottom = face.getbbox(char, anchor='ls', stroke_width=stroke)
+    if right <= left or bottom <= top:
+        return np.zeros((0, 0), np.uint8), 0, 0  # whitespace
+    mask = Image.new('L', (right - left, bottom - top), 0)
+    ImageDraw.Draw(mask).text((-left, -top), char, fill=255, font=face, anchor='ls', stroke_width=stroke, stroke_fill=255)
+    return np.asarray(mask), left, top
+
+
+@lru_cache(maxsize=65536)
+def advance(font, size, char):
+    return load_font(font, size).getlength(char)
+
+
+@lru_cache(maxsize=65536)
+def kerning(font, size, pair):
+    face = load_font(font, size)
+    return face.getlength(pair) - face.getlength(pair[0]) - face.getlength(pair[1])
+
+
+def pen_positions(font, size, text):
+    # x of each glyph's origin along the baseline, kerned against the glyph before it; plus the line advance
+    positions = []
+    x = 0.0
+    for index, char in enumerate(text):
+        if index:
+            x += kerning(font, size, text[index - 1:index + 1])
+        positions.append(int(round(x)))
+        x += advance(font, size, char)
+    return positions, x
+
+
+@lru_cache(maxsize=8192)
+def text_size(text, font, font_scale, font_thickness):
+    # The same shape as cv2.getTextSize: ((width, height above the baseline), depth below it)
+    stroke = fill_stroke(font_thickness)
+    size = font_pixel_size(font_scale)
+    _, top, _, bottom = load_font(font, size).getbbox(text, anchor='ls', stroke_width=stroke)
+    return (int(round(pen_positions(font, size, text)[1])) + 2 * stroke, -top), bottom
+
+
+def placed_glyphs(text, font, size, stroke, atlas=ATLAS):
+    # (mask, left, top) of every visible glyph in the line, relative to the origin
+    placed = []
+    for char, x in zip(text, pen_positions(font, size, text)[0]):
+        mask, left, top = atlas.glyph(font, size, stroke, char)
+        if mask.size:
+            placed.append((mask, x + left, top))
+    return placed
+
+
+def glyph_bounds(placed):
+    return (min(x for _, x, _ in placed), min(y for _, _, y in placed),
+            max(x + mask.shape[1] for mask, x, _ in placed), max(y + mask.shape[0] for mask, _, y in placed))
+
+
+def line_mask(text, font, size, stroke, atlas=ATLAS):
+    # One coverage mask for the line, composed from cached glyphs; returns (mask, left, top)
+    placed = placed_glyphs(text, font, size, stroke, atlas)
+    if not placed:
+        return None
+    left, top, right, bottom = glyph_bounds(placed)
+    line = np.zeros((bottom - top, right - left), np.uint8)
+    for mask, x, y in placed:
+        region = line[y - top:y - top + mask.shape[0], x - left:x - left + mask.shape[1]]
+        np.maximum(region, mask, out=region)
+    return line, left, top
+
+
+def line_extent(text, font, font_scale, font_thickness, outline_thickness, atlas=ATLAS):
+    # (left, top, right, bottom) of everything draw_outline and draw_text paint, relative to the origin
+    stroke = fill_stroke(font_thickness) + max(0, outline_thickness)
+    placed = placed_glyphs(text, font, font_pixel_size(font_scale), stroke, atlas)
+    return glyph_bounds(placed) if placed else (0, 0, 0, 0)
+
+
+def blend_over(region, color, coverage):
+    # Straight-alpha "over" of `color` (an RGB triple, or per-pixel RGB) at `coverage` (0-255) onto
+    # an RGBA region, so antialiased edges work on opaque frames and transparent tiles alike
+    if region[:, :, 3].min() == 255:
+        # Opaque destination, the usual case: integer blend, alpha stays 255
+        alpha = coverage[:, :, None].astype(np.uint16)
+        region[:, :, :3] = (np.asarray(color, np.uint16) * alpha + region[:, :, :3] * (255 - alpha) + 127) // 255
+        return
+    coverage = coverage / 255.0
+    destination_alpha = region[:, :, 3] / 255.0
+    alpha = coverage + destination_alpha * (1 - coverage)
+    weight = destination_alpha * (1 - coverage)
+    rgb = np.asarray(color, np.float64) * coverage[:, :, None] + region[:, :, :3] * weight[:, :, None]
+    visible = alpha > 0
+    region[:, :, :3][visible] = np.rint(rgb[visible] / alpha[visible][:, None])
+    region[:, :, 3] = np.rint(alpha * 255)
+
+
+def blend_mask(image_np, mask, left, top, org, color):
+    x, y = org[0] + left, org[1] + top
+    image_height, image_width = image_np.shape[:2]
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(image_width, x + mask.shape[1]), min(image_height, y + mask.shape[0])
+    if x0 >= x1 or y0 >= y1:
+        return
+    coverage = mask[y0 - y:y1 - y, x0 - x:x1 - x]
+    blend_over(image_np[y0:y1, x0:x1], color, coverage)
+
+
+def draw_outline(image_np, text, org, font, font_scale, font_thickness, outline_color, outline_thickness, atlas=ATLAS):
+    # The outline is the glyphs stroked `outline_thickness` pixels wider, drawn under the fill
+    line = line_mask(text, font, font_pixel_size(font_scale), fill_stroke(font_thickness) + outline_thickness, atlas)
+    if line is not None:
+        blend_mask(image_np, *line, org, outline_color)
+
+
+def draw_text(image_np, text, org, font, font_scale, font_thickness, font_color, atlas=ATLAS):
+    line = line_mask(text, font, font_pixel_size(font_scale), fill_stroke(font_thickness), atlas)
+    if line is not None:
+        blend_mask(image_np, *line, org, font_color)
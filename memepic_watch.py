@@ -0,0 +1,243 @@
+"""Watch-folder mode: caption every new image dropped into a folder with a saved preset, once."""
+import hashlib
+import json
+import os
+import signal
+import sys
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from memepic_cache import canonical_spec
+from memepic_cli import IMAGE_EXTENSIONS, output_path_for, render_job
+from memepic_export import ExportOptions
+from memepic_render import CaptionSpec
+
+INDEX_NAME = '.memepic-watch.jsonl'
+THROUGHPUT_WINDOW = 60  # seconds of completions behind the images/min figure
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def preset_key(spec, options):
+    # Everything that changes an output, so a file captioned with an older preset is done again
+    settings = json.dumps({'spec': canonical_spec(spec), 'format': options.format, 'save': options.save_arguments(),
+                           'sizes': options.config_sizes()}, sort_keys=True)
+    return hashlib.sha256(settings.encode()).hexdigest()
+
+
+def watch_job(image_path, output_path, spec_dict, options, known_digest=None, cache=None, frame_workers=1):
+    # Runs in a pool worker. A file whose bytes match what was captioned before (touched, or
+    # copied over itself) is not rendered again.
+    digest = file_digest(image_path)
+    if digest == known_digest:
+        return {'sha256': digest, 'status': 'unchanged'}
+    output_path, seconds, hit = render_job(image_path, output_path, spec_dict, options, cache, frame_workers)
+    return {'sha256': digest, 'status': 'ok', 'output': output_path, 'ms': round(seconds * 1000, 1), 'cache_hit': hit}
+
+
+def ignore_interrupts():
+    # Ctrl+C stops the watcher, which lets jobs already running finish; workers don't see it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class WatchIndex:
+    # Processed files by absolute path with the size, mtime and hash they had and the preset they
+    # were captioned with, as JSON lines; the last line for a path wins. Compacted on open, appended
+    # to as files finish.
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                for line in file:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a line cut short when the process was killed
+                    self.entries[entry['path']] = entry
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            for entry in self.entries.values():
+                file.write(json.dumps(entry) + "\n")
+        os.replace(temp_path, path)
+        self._file = open(path, 'a', encoding='utf-8')
+
+    def done(self, path, size, mtime_ns, preset):
+        entry = self.entries.get(path)
+        return (entry is not None and entry['size'] == size and entry['mtime_ns'] == mtime_ns
+                and entry.get('preset') == preset)
+
+    def digest(self, path, preset):
+        # Only a file captioned with the same preset can be skipped for having the same bytes
+        entry = self.entries.get(path)
+        return entry.get('sha256') if entry is not None and entry.get('preset') == preset else None
+
+    def record(self, entry):
+        self.entries[entry['path']] = entry
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def scan_folder(input_folder):
+    # (absolute path, size, mtime_ns, mtime) of every image directly in the folder
+    found = []
+    with os.scandir(input_folder) as entries:
+        for entry in entries:
+            if not entry.name.lower().endswith(IMAGE_EXTENSIONS) or entry.name.startswith('.'):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue  # removed while scanning
+            found.append((os.path.abspath(entry.path), stat.st_size, stat.st_mtime_ns, stat.st_mtime))
+    return found
+
+
+class WatchStatus:
+    def __init__(self):
+        self.started = time.time()
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self.completions = deque()
+        self._last_line = None
+        self._last_counts = None
+        self._interactive = sys.stdout.isatty()
+
+    def completed(self):
+        now = time.time()
+        self.completions.append(now)
+        while self.completions and now - self.completions[0] > THROUGHPUT_WINDOW:
+            self.completions.popleft()
+
+    def per_minute(self):
+        window = min(THROUGHPUT_WINDOW, max(1.0, time.time() - self.started))
+        return len(self.completions) * 60 / window
+
+    def show(self, backlog, in_flight):
+        counts = (backlog, in_flight, self.done, self.skipped, self.failed)
+        line = (f"backlog {backlog}, rendering {in_flight}, done {self.done}, unchanged {self.skipped}, "
+                f"failed {self.failed}, {self.per_minute():.1f} images/min")
+        if self._interactive:
+            print(f"\r{line}   ", end='', flush=True)
+        elif counts != self._last_counts:
+            # Logs get a line when the counts change rather than carriage returns
+            print(line, flush=True)
+        self._last_line = line
+        self._last_counts = counts
+
+    def message(self, text):
+        if self._interactive and self._last_line is not None:
+            print()  # keep the status line above the message
+            self._last_line = None
+        print(text, flush=True)
+
+    def finish(self):
+        if self._interactive and self._last_line is not None:
+            print()
+
+
+def run_watch(input_folder, spec, options, output_folder, workers, index_path=None, interval=1.0, settle=2.0,
+              cache=None, once=False, frame_workers=1, verbose=False):
+    # Polls `input_folder` every `interval` seconds. A file is picked up once it has not been
+    # modified for `settle` seconds, so images still being copied in are left alone.
+    if not os.path.isdir(input_folder):
+        print(f"Not a folder: {input_folder}")
+        return 1
+    os.makedirs(output_folder, exist_ok=True)
+    if os.path.samefile(input_folder, output_folder):
+        print("The output folder must differ from the watched folder, or outputs would be captioned again")
+        return 1
+    index = WatchIndex(index_path or os.path.join(output_folder, INDEX_NAME))
+    spec_dict = spec.to_dict()
+    preset = preset_key(spec, options)
+    status = WatchStatus()
+    backlog = OrderedDict()  # path -> (size, mtime_ns), oldest first
+    pending = {}  # future -> (path, size, mtime_ns)
+    in_flight = set()
+    last_scan = 0.0
+    print(f"Watching {input_folder} -> {output_folder} ({workers} workers, {len(index.entries)} files already indexed)")
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=ignore_interrupts) as pool:
+            while True:
+                now = time.time()
+                if now - last_scan >= interval:
+                    last_scan = now
+                    try:
+                        found = scan_folder(input_folder)
+                    except OSError as e:
+                        status.message(f"Error scanning {input_folder}: {e}")
+                        found = []
+                    for path, size, mtime_ns, mtime in found:
+                        if path in in_flight or index.done(path, size, mtime_ns, preset):
+                            continue
+                        if now - mtime < settle and not once:
+                            backlog.pop(path, None)  # still being written
+                            continue
+                        backlog[path] = (size, mtime_ns)
+
+                # Bounded in flight, so a large drop doesn't queue every file in the pool at once
+                while backlog and len(pending) < 2 * workers:
+                    path, (size, mtime_ns) = backlog.popitem(last=False)
+                    # The source extension stays in the name, so photo.jpg and photo.png never share an output
+                    future = pool.submit(watch_job, path, output_path_for(path, output_folder, options.extension, keep_extension=True),
+                                         spec_dict, options, index.digest(path, preset), cache, frame_workers)
+                    pending[future] = (path, size, mtime_ns)
+                    in_flight.add(path)
+
+                status.show(len(backlog), len(pending))
+                if once and not backlog and not pending:
+                    break
+                if not pending:
+                    time.sleep(interval)
+                    continue
+                done, _ = wait(pending, timeout=interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, size, mtime_ns = pending.pop(future)
+                    in_flight.discard(path)
+                    entry = {'path': path, 'size': size, 'mtime_ns': mtime_ns, 'preset': preset}
+                    try:
+                        entry.update(future.result())
+                    except Exception as e:
+                        # Recorded, so a broken file is retried only once it changes
+                        entry.update({'status': 'error', 'error': str(e)})
+                        status.failed += 1
+                        status.message(f"Error rendering {path}: {e}")
+                    else:
+                        if entry['status'] == 'unchanged':
+                            entry['output'] = index.entries.get(path, {}).get('output')
+                            status.skipped += 1
+                        else:
+                            status.done += 1
+                            status.completed()
+                            if verbose:
+                                status.message(f"Image saved to {entry['output']} ({entry['ms']:.0f} ms)")
+                    index.record(entry)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        status.finish()
+        index.close()
+    print(f"Captioned {status.done} images ({status.skipped} unchanged, {status.failed} failed)")
+    return 1 if status.failed else 0
+
+
+def load_preset(preset_path):
+    # A config.json saved by the MEMEPIC app, or any JSON file with the same fields
+    with open(preset_path, 'r') as file:
+        config = json.load(file)
+    return CaptionSpec.from_config(config), ExportOptions.from_config(config), config.get('output_folder') or None
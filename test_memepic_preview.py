@@ -0,0 +1,16 @@
+"""The proxy preview must place the caption where the full-resolution render does."""
+import pytest
+from PIL import Image
+
+from memepic_render import CaptionSpec
+from memepic_testing import SAMPLE_SLOGAN, preview_layout_error
+
+
+@pytest.mark.parametrize('size', [(640, 480), (1920, 1080), (1080, 1920), (4000, 3000)])
+@pytest.mark.parametrize('lines', [1, 3])
+@pytest.mark.parametrize('text_position', [0, 25, 50, 100])
+def test_preview_bbox_matches_full_render(size, lines, text_position):
+    image = Image.new('RGBA', size, (128, 128, 128, 255))
+    spec = CaptionSpec("\n".join(SAMPLE_SLOGAN.split("\n")[:lines]), font_scale=5, font_thickness=6,
+                       outline_thickness=5, box_opacity=0.5, box_width=80, text_position=text_position)
+    assert preview_layout_error(image, spec) <= 1
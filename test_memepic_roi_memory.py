@@ -0,0 +1,39 @@
+"""Drawing a caption allocates memory for the caption's region only, never for the whole frame."""
+import numpy as np
+import pytest
+
+from memepic_render import CaptionSpec, draw_caption, layout_caption
+from memepic_testing import SAMPLE_SLOGAN, peak_allocation
+
+FRAME_SIZES = [(2000, 1500), (4000, 3000), (12000, 8500)]
+
+
+def caption_peak(size, box_opacity):
+    # (peak bytes allocated by draw_caption, bytes of the caption's RGBA region)
+    width, height = size
+    image_np = np.zeros((height, width, 4), np.uint8)
+    spec = CaptionSpec(SAMPLE_SLOGAN, font_scale=5, font_thickness=6, outline_thickness=5, box_opacity=box_opacity,
+                       box_width=60, text_position=80)
+    layout = layout_caption(width, height, spec)
+    boxes = layout.line_boxes()
+    if spec.use_box:
+        boxes.append(layout.box_rect(spec.box_width))
+    left, top = min(box[0] for box in boxes), min(box[1] for box in boxes)
+    right, bottom = max(box[2] for box in boxes), max(box[3] for box in boxes)
+    _, peak = peak_allocation(lambda: draw_caption(image_np, layout, spec))
+    return peak, (right - left + 1) * (bottom - top + 1) * 4
+
+
+@pytest.mark.parametrize('size', FRAME_SIZES)
+@pytest.mark.parametrize('box_opacity', [0.0, 0.5])
+def test_peak_is_a_small_multiple_of_the_caption(size, box_opacity):
+    peak, roi_bytes = caption_peak(size, box_opacity)
+    assert peak <= 2 * roi_bytes
+    assert peak < size[0] * size[1]  # a quarter of the RGBA frame
+
+
+def test_peak_does_not_grow_with_the_frame():
+    # Without a box the caption is the same size on every frame (font_scale is capped), so the
+    # high-water mark must be too
+    peaks = [caption_peak(size, 0.0)[0] for size in FRAME_SIZES]
+    assert max(peaks) <= 1.1 * min(peaks)